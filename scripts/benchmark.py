@@ -9,108 +9,374 @@ root = pyrootutils.setup_root(
 import hydra
 import logging
 from omegaconf import DictConfig
-from src.ingestion import PDFLoader, get_chunker
-from src.vector_store import HybridQdrantClient
+from src.vector_store import get_vector_store, get_collection_name
 from src.retrieval import HybridRetriever
 from src.generation import InferenceEngine
+from src.tracing import Tracer, NULL_TRACER
+from src.context import ContextPacker, get_packer, build_context
+from src.cache import SemanticAnswerCache
+from src.models import REGISTRY
+from src.cache import text_hash
+from src.evaluation import financebench_qrels, retrieval_metrics, latency_stats, synthetic_corpus
 from datasets import load_dataset
 import pandas as pd
 import os
+import json
 import glob
+import asyncio
+import time
 from tqdm import tqdm
+from typing import Optional
 
 log = logging.getLogger(__name__)
 
-def get_collection_name(cfg):
-    # Dynamic collection name based on chunking strategy
-    if cfg.chunking.strategy == "fixed":
-        return f"finance_fixed_{cfg.chunking.chunk_size}_{cfg.chunking.chunk_overlap}"
-    else:
-        return f"finance_semantic_{cfg.chunking.breakpoint_percentile_threshold}"
-
 def ensure_ingestion(cfg, vector_store):
-    if vector_store.client.collection_exists(vector_store.collection_name):
-        log.info(f"Collection {vector_store.collection_name} exists. Skipping ingestion.")
+    """Brings the collection in line with the PDFs in data/raw.
+
+    Only new or changed PDFs (by content hash) are parsed and indexed, and
+    the chunks of removed or changed PDFs are deleted.
+    """
+    # Parsing and chunking code is only needed here, not by query-only runs
+    from src.ingestion import get_loader, get_chunker, file_sha256, assign_chunk_ids, IngestionManifest
+    manifest = IngestionManifest(
+        os.path.join(cfg.data.processed_dir, "manifests", f"{vector_store.collection_name}.json")
+    )
+    if vector_store.count() == 0:
+        # Fresh (or dropped) collection: whatever the manifest says is gone
+        manifest.clear()
+    elif not manifest.files:
+        log.warning(f"Collection {vector_store.collection_name} has points but no ingestion manifest. "
+                    "Skipping ingestion; drop the collection to rebuild it incrementally.")
         return
 
-    log.info(f"Ingesting PDFs for {vector_store.collection_name}...")
-    pdf_loader = PDFLoader()
-    chunker = get_chunker(cfg)
-    
     # Process all PDFs in data/raw
-    pdf_files = glob.glob(os.path.join(cfg.data.raw_dir, "*.pdf"))
-    if not pdf_files:
+    pdf_files = sorted(glob.glob(os.path.join(cfg.data.raw_dir, "*.pdf")))
+    if not pdf_files and not manifest.files:
         log.warning(f"No PDF files found in {cfg.data.raw_dir}!")
         return
 
-    all_nodes = []
-    for pdf_path in tqdm(pdf_files, desc="Parsing PDFs"):
-        docs = pdf_loader.load(pdf_path)
-        nodes = chunker.chunk(docs)
-        all_nodes.extend(nodes)
-    
-    vector_store.index(all_nodes)
+    current = {pdf_path: file_sha256(pdf_path) for pdf_path in pdf_files}
+    changed, removed = manifest.diff(current)
+    if not changed and not removed:
+        log.info(f"Collection {vector_store.collection_name} is up to date. Skipping ingestion.")
+        return
+
+    log.info(f"Ingesting {len(changed)} new/changed PDFs and removing {len(removed)} PDFs "
+             f"for {vector_store.collection_name}...")
+
+    # Drop the chunks of removed and changed documents (unless the same content is still present)
+    live_hashes = set(current.values())
+    stale_names = removed + [os.path.basename(path) for path in changed]
+    stale_hashes = {
+        manifest.files[name]["sha256"] for name in stale_names
+        if name in manifest.files and manifest.files[name]["sha256"] not in live_hashes
+    }
+    vector_store.delete_documents(sorted(stale_hashes))
+    for name in removed:
+        manifest.remove(name)
+
+    if changed:
+        pdf_loader = get_loader(cfg, cache_dir=os.path.join(cfg.data.processed_dir, "parsed"))
+        chunker = get_chunker(cfg)
+        chunk_counts = {}
+
+        def iter_nodes():
+            # Parse and chunk one PDF at a time so nodes stream straight into indexing
+            for pdf_path in tqdm(changed, desc="Parsing PDFs"):
+                docs = pdf_loader.load(pdf_path, file_hash=current[pdf_path])
+                nodes = assign_chunk_ids(chunker.chunk(docs), current[pdf_path])
+                chunk_counts[pdf_path] = len(nodes)
+                yield from nodes
+
+        total = vector_store.index(iter_nodes(), batch_size=cfg.ingestion.batch_size)
+        for pdf_path in changed:
+            manifest.record(pdf_path, current[pdf_path], chunk_counts[pdf_path])
+        log.info(f"Indexed {total} chunks.")
+
+    manifest.save()
     log.info("Ingestion complete.")
 
+def index_synthetic(cfg, vector_store, documents):
+    """Chunks and indexes the synthetic corpus, one "file" per document name."""
+    from src.ingestion import get_chunker, assign_chunk_ids
+    chunker = get_chunker(cfg)
+    by_source = {}
+    for doc in documents:
+        by_source.setdefault(doc.metadata["source"], []).append(doc)
+
+    def iter_nodes():
+        for source, docs in by_source.items():
+            yield from assign_chunk_ids(chunker.chunk(docs), text_hash(source))
+
+    total = vector_store.index(iter_nodes(), batch_size=cfg.ingestion.batch_size)
+    log.info(f"Indexed {total} synthetic chunks from {len(by_source)} documents.")
+
+def evaluate_retrieval(cfg, retriever, queries, qrels, run_id: str, corpus: str) -> dict:
+    """Retrieval-only pass: ranx quality, batched throughput and single-query latency."""
+    # Load every query-time model before anything is timed
+    retriever.retrieve_batch(queries[:1])
+
+    batch_size = cfg.retrieval.query_batch_size
+    candidates_batch = []
+    start = time.perf_counter()
+    for i in tqdm(range(0, len(queries), batch_size), desc="Retrieval (batched)"):
+        candidates_batch.extend(retriever.retrieve_batch(queries[i:i + batch_size]))
+    elapsed = time.perf_counter() - start
+
+    latencies = []
+    for query in tqdm(queries[:cfg.evaluation.latency_queries or None], desc="Retrieval (single query)"):
+        start = time.perf_counter()
+        retriever.retrieve(query)
+        latencies.append(time.perf_counter() - start)
+
+    return {
+        "run_id": run_id,
+        "corpus": corpus,
+        "chunking": cfg.chunking.strategy,
+        "retrieval": cfg.retrieval.strategy,
+        "fusion": cfg.retrieval.fusion,
+        "top_k_retrieval": cfg.retrieval.top_k_retrieval,
+        "top_k_final": cfg.retrieval.top_k_final,
+        "reranker": cfg.retrieval.reranker,
+        "reranker_backend": cfg.retrieval.reranker_backend,
+        "cascade": cfg.retrieval.cascade.enabled,
+        "quantization": cfg.qdrant.quantization,
+        "queries": len(queries),
+        **retrieval_metrics(qrels, candidates_batch, k=cfg.evaluation.k),
+        "qps": len(queries) / elapsed,
+        **latency_stats(latencies),
+    }
+
+async def run_queries(ds, retriever, engine, batch_size: int, packer: Optional[ContextPacker] = None,
+                      tracer: Tracer = NULL_TRACER, answer_cache: Optional[SemanticAnswerCache] = None):
+    """Retrieval/generation pipeline over the dataset.
+
+    A producer retrieves question batches in a worker thread while a
+    consumer fans their generations out to the LLM, so retrieval of the next
+    batch overlaps generation of the current one. Returns
+    ``(row, candidates, context_docs, generation)`` tuples in dataset order,
+    where ``generation`` is the dict returned by ``InferenceEngine.agenerate_timed``
+    merged with the context packing token counts. With an ``answer_cache`` a
+    hit reuses the cached answer and skips the LLM call (``cache_hit`` is set).
+    """
+    queue = asyncio.Queue(maxsize=1)
+    outputs = [None] * len(ds)
+    pbar = tqdm(total=len(ds))
+
+    async def produce():
+        for start in range(0, len(ds), batch_size):
+            end = min(start + batch_size, len(ds))
+            rows = ds.select(range(start, end))
+            with tracer.trace([str(i) for i in range(start, end)]):
+                candidates_batch, query_vectors = await asyncio.to_thread(
+                    retriever.retrieve_batch, rows['question'], with_query_vectors=True
+                )
+            await queue.put((start, rows, candidates_batch, query_vectors))
+        await queue.put(None)
+
+    async def answer(i, row, candidates, query_vector):
+        # Generate (pass top 5 candidates, or the token-budgeted packing of all of them)
+        with tracer.trace([str(i)]):
+            with tracer.span("context_packing"):
+                context_docs, context_stats = build_context(candidates, packer)
+            chunk_ids = [doc['id'] for doc in candidates]
+            cached = answer_cache.lookup(query_vector, chunk_ids) if answer_cache is not None else None
+            if cached is not None:
+                # No LLM call: leave the speed/usage columns empty so their means only cover real calls
+                generation = {
+                    "answer": cached, "ttft_s": None, "latency_s": None,
+                    "prompt_tokens": None, "completion_tokens": None, "tokens_per_sec": None,
+                }
+            else:
+                generation = await engine.agenerate_timed(row['question'], context_docs)
+                if answer_cache is not None:
+                    answer_cache.insert(query_vector, chunk_ids, generation["answer"])
+        outputs[i] = (row, candidates, context_docs, {**generation, **context_stats, "cache_hit": cached is not None})
+        pbar.update(1)
+
+    async def consume():
+        tasks = []
+        while (item := await queue.get()) is not None:
+            start, rows, candidates_batch, query_vectors = item
+            for offset, (row, candidates, vector) in enumerate(zip(rows, candidates_batch, query_vectors)):
+                tasks.append(asyncio.create_task(answer(start + offset, row, candidates, vector)))
+            # Bound how far retrieval may run ahead: wait until at most one
+            # batch of generations is outstanding before taking the next one.
+            pending = [task for task in tasks if not task.done()]
+            while len(pending) > batch_size:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        await asyncio.gather(*tasks)
+
+    try:
+        await asyncio.gather(produce(), consume())
+    finally:
+        pbar.close()
+    return outputs
+
 @hydra.main(version_base=None, config_path="../conf", config_name="config")
 def main(cfg: DictConfig):
     # 1. Update collection name in config based on chunking
     cfg.qdrant.collection_name = get_collection_name(cfg)
     
-    # 2. Ingest
-    vector_store = HybridQdrantClient(cfg)
-    ensure_ingestion(cfg, vector_store)
-    
-    # 3. Load Test Set (FinanceBench)
+    run_id = f"{cfg.model.name}_{cfg.chunking.strategy}_{cfg.retrieval.strategy}"
+    if cfg.qdrant.quantization != "none":
+        run_id += f"_{cfg.qdrant.quantization}"
+    if cfg.evaluation.synthetic.enabled:
+        run_id = f"synthetic_{cfg.chunking.strategy}_{cfg.retrieval.strategy}"
+    os.makedirs("outputs", exist_ok=True)
+    tracer = Tracer(enabled=cfg.tracing.enabled, path=os.path.join("outputs", f"{run_id}_trace.jsonl"))
     try:
-        log.info(f"Loading FinanceBench split: {cfg.data.split}")
-        ds = load_dataset("PatronusAI/financebench", split=cfg.data.split)
-    except Exception as e:
-        log.error(f"Could not load FinanceBench from HF: {e}. Checking local.")
-        raise NotImplementedError
+        run(cfg, run_id, tracer)
+    finally:
+        # Retrieval-only and failed runs flush their trace and stage summary too
+        if tracer.enabled:
+            tracer.close()
+            stages = pd.DataFrame.from_dict(tracer.summary(), orient="index")
+            stages.index.name = "stage"
+            stages.to_csv(os.path.join("outputs", f"{run_id}_stages.csv"))
+            log.info(f"Per-stage latency (ms):\n{stages.round(2).to_string()}")
+
+def run(cfg: DictConfig, run_id: str, tracer: Tracer):
+    retrieval_only = cfg.evaluation.retrieval_only or cfg.evaluation.synthetic.enabled
+    if retrieval_only and cfg.evaluation.disable_caches:
+        # Cached embeddings/scores would make the timings meaningless
+        cfg.cache.query_embeddings = False
+        cfg.cache.rerank_scores = False
+
+    # 2. Ingest (the synthetic corpus goes into a throwaway in-memory collection)
+    if cfg.evaluation.synthetic.enabled:
+        synthetic = cfg.evaluation.synthetic
+        cfg.qdrant.host = ":memory:"
+        documents, queries, qrels = synthetic_corpus(
+            num_docs=synthetic.num_docs,
+            pages_per_doc=synthetic.pages_per_doc,
+            num_queries=synthetic.num_queries,
+            seed=synthetic.seed
+        )
+        vector_store = get_vector_store(cfg, tracer=tracer)
+        index_synthetic(cfg, vector_store, documents)
+    else:
+        vector_store = get_vector_store(cfg, tracer=tracer)
+        ensure_ingestion(cfg, vector_store)
+
+        # 3. Load Test Set (FinanceBench)
+        try:
+            log.info(f"Loading FinanceBench split: {cfg.data.split}")
+            ds = load_dataset("PatronusAI/financebench", split=cfg.data.split)
+        except Exception as e:
+            log.error(f"Could not load FinanceBench from HF: {e}. Checking local.")
+            raise NotImplementedError
+        queries = list(ds['question'])
+        qrels = financebench_qrels(ds)
 
-    retriever = HybridRetriever(vector_store, cfg)
-    engine = InferenceEngine(cfg)
+    retriever = HybridRetriever(vector_store, cfg, tracer=tracer)
+
+    if retrieval_only:
+        # One row per configuration, appended so a Hydra multirun sweep builds one table
+        row = evaluate_retrieval(cfg, retriever, queries, qrels, run_id,
+                                 corpus="synthetic" if cfg.evaluation.synthetic.enabled else "financebench")
+        # Dense index layout: recall vs exact search, search latency and memory (quantization/HNSW sweeps)
+        row.update(vector_store.index_report(queries, top_k=cfg.retrieval.top_k_retrieval))
+        sweep_file = os.path.join("outputs", "retrieval_sweep.csv")
+        table = pd.DataFrame([row])
+        if os.path.exists(sweep_file):
+            table = pd.concat([pd.read_csv(sweep_file), table], ignore_index=True)
+        table.to_csv(sweep_file, index=False)
+        log.info(f"Retrieval metrics: {row}")
+        log.info(f"Appended to {sweep_file}")
+        return
+
+    engine = InferenceEngine(cfg, tracer=tracer)
 
     # 4. Run Loop
-    run_id = f"{cfg.model.name}_{cfg.chunking.strategy}_{cfg.retrieval.strategy}"
     trec_file = os.path.join("outputs", f"{run_id}.trec")
-    results_file = os.path.join("outputs", f"{run_id}_results.csv")
-    
-    os.makedirs("outputs", exist_ok=True)
+    results_file = os.path.join("outputs", f"{run_id}_results.jsonl")
     
+    packer = get_packer(cfg)
+    answer_cache = None
+    if cfg.answer_cache.enabled:
+        answer_cache = SemanticAnswerCache(
+            similarity_threshold=cfg.answer_cache.similarity_threshold,
+            ttl_seconds=cfg.answer_cache.ttl_seconds,
+            max_entries=cfg.answer_cache.max_entries
+        )
+    outputs = asyncio.run(run_queries(
+        ds, retriever, engine,
+        batch_size=cfg.retrieval.query_batch_size,
+        packer=packer,
+        tracer=tracer,
+        answer_cache=answer_cache
+    ))
+
     trec_lines = []
     final_results = []
-    
-    for i, row in enumerate(tqdm(ds)):
-        query = row['question']
+    for i, (row, candidates, context_docs, generation) in enumerate(outputs):
         query_id = str(i) # Use index or row['id']
-        
-        # Retrieve
-        candidates = retriever.retrieve(query)
-        
+
         # Log TREC
         for rank, doc in enumerate(candidates):
             # query_id Q0 doc_id rank score run_id
             trec_lines.append(f"{query_id} Q0 {doc['id']} {rank+1} {doc['score']} {run_id}")
 
-        # Generate (pass top 5 candidates)
-        best_candidates = candidates[:5]
-        answer = engine.generate(query, best_candidates)
-        
         final_results.append({
-            "question": query,
+            "question": row['question'],
             "ground_truth": row.get('answer', ''),
-            "generated_answer": answer,
-            "context": [str(c['text']) for c in best_candidates],
-            "config": run_id
+            "generated_answer": generation["answer"],
+            "context": [str(c['text']) for c in context_docs],
+            "config": run_id,
+            "ttft_s": generation["ttft_s"],
+            "latency_s": generation["latency_s"],
+            "prompt_tokens": generation["prompt_tokens"],
+            "completion_tokens": generation["completion_tokens"],
+            "tokens_per_sec": generation["tokens_per_sec"],
+            "context_tokens": generation.get("context_tokens"),
+            "context_tokens_saved": generation.get("context_tokens_saved"),
+            "answer_cache_hit": generation["cache_hit"]
         })
 
+    # Retrieval quality of the reranked candidates against the evidence pages
+    retrieval_scores = retrieval_metrics(qrels, [candidates for _, candidates, _, _ in outputs], k=cfg.evaluation.k)
+    with open(os.path.join("outputs", f"{run_id}_retrieval.json"), "w") as f:
+        json.dump(retrieval_scores, f, indent=2)
+    log.info(f"Retrieval metrics: {retrieval_scores}")
+
+    # Dense index recall vs memory vs latency for this layout
+    index_report = vector_store.index_report(list(ds['question']), top_k=cfg.retrieval.top_k_retrieval)
+    with open(os.path.join("outputs", f"{run_id}_index_report.json"), "w") as f:
+        json.dump(index_report, f, indent=2)
+    log.info(f"Index report: {index_report}")
+
     # Save outputs
     with open(trec_file, "w") as f:
         f.write("\n".join(trec_lines))
     
-    pd.DataFrame(final_results).to_csv(results_file, index=False)
+    # One JSON object per question: context stays a list of strings, numbers stay numbers
+    with open(results_file, "w") as f:
+        for result in final_results:
+            f.write(json.dumps(result) + "\n")
+    for stats in vector_store.cache_stats():
+        log.info(f"Query embedding cache ({stats['kind']}, {stats['model']}): "
+                 f"{stats['hits']} hits ({stats['disk_hits']} from disk), {stats['misses']} misses")
+    if retriever.score_cache is not None:
+        stats = retriever.score_cache.stats()
+        log.info(f"Rerank score cache ({stats['model']}): {stats['hits']} hits, {stats['misses']} misses")
+    if answer_cache is not None:
+        stats = answer_cache.stats()
+        log.info(f"Answer cache: {stats['hits']} hits, {stats['misses']} misses "
+                 f"({stats['hit_rate']:.0%} hit rate, {stats['stale_matches']} similar queries with changed context)")
+    if packer is not None:
+        results_df = pd.DataFrame(final_results)
+        log.info(f"Context packing: {results_df['context_tokens'].mean():.0f} prompt context tokens/query, "
+                 f"{results_df['context_tokens_saved'].sum()} tokens saved in total")
+    if retriever.rerank_log:
+        rerank_log = pd.DataFrame(list(retriever.rerank_log))
+        rerank_log.to_csv(os.path.join("outputs", f"{run_id}_rerank_log.csv"), index=False)
+        log.info(f"Rerank pairs per query: stage1={rerank_log['stage1_pairs'].mean():.1f} "
+                 f"stage2={rerank_log['stage2_pairs'].mean():.1f} "
+                 f"early exits={rerank_log['early_exit'].mean():.0%}")
+    load_times = REGISTRY.report()
+    if load_times:
+        log.info("Model load times: " + ", ".join(f"{name} {seconds:.1f}s" for name, seconds in load_times.items()))
     log.info(f"Finished run {run_id}. Saved to {results_file}")
 
 if __name__ == "__main__":
@@ -0,0 +1,101 @@
+import pyrootutils
+root = pyrootutils.setup_root(
+    search_from=__file__,
+    indicator=".project-root",
+    pythonpath=True,
+    dotenv=True,
+)
+
+import hydra
+import json
+import logging
+import os
+import time
+import numpy as np
+from omegaconf import DictConfig
+from datasets import load_dataset
+from src.vector_store import get_vector_store, get_collection_name
+from src.rerankers import TorchReranker, get_reranker
+from src.cache import model_slug
+
+log = logging.getLogger(__name__)
+
+# Compares the configured reranker backend (e.g. retrieval.reranker_backend=onnx)
+# against the PyTorch CrossEncoder on real FinanceBench candidates, for the main
+# reranker and the cascade's first-stage model:
+#   python scripts/check_reranker.py retrieval.reranker_backend=onnx
+
+def spearman(a: np.ndarray, b: np.ndarray) -> float:
+    if len(a) < 2:
+        return 1.0
+    rank_a = np.argsort(np.argsort(a))
+    rank_b = np.argsort(np.argsort(b))
+    return float(np.corrcoef(rank_a, rank_b)[0, 1])
+
+@hydra.main(version_base=None, config_path="../conf", config_name="config")
+def main(cfg: DictConfig):
+    cfg.qdrant.collection_name = get_collection_name(cfg)
+
+    vector_store = get_vector_store(cfg)
+    ds = load_dataset("PatronusAI/financebench", split=cfg.data.split)
+    queries = list(ds['question'])
+
+    # Candidate texts per query from first-stage retrieval
+    candidates = []
+    for results in vector_store.search_batch(queries, top_k=cfg.retrieval.top_k_retrieval):
+        points = results.get("fused") or results["dense"] + results["sparse"]
+        texts = list(dict.fromkeys(p.payload.get("text", "") for p in points))
+        candidates.append(texts)
+    pairs = [[q, t] for q, texts in zip(queries, candidates) for t in texts]
+
+    # The main reranker and, if configured, the cascade's first-stage cross-encoder
+    model_names = [cfg.retrieval.reranker]
+    if cfg.retrieval.cascade.first_stage != "fusion":
+        model_names.append(cfg.retrieval.cascade.first_stage)
+    os.makedirs("outputs", exist_ok=True)
+    for model_name in model_names:
+        report = compare(cfg, model_name, candidates, pairs)
+        path = os.path.join("outputs", f"reranker_check_{report['backend']}_{model_slug(model_name)}.json")
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        log.info(f"Reranker check: {json.dumps(report, indent=2)}")
+
+def compare(cfg: DictConfig, model_name: str, candidates, pairs) -> dict:
+    reference = TorchReranker(model_name, max_length=cfg.retrieval.reranker_max_length)
+    candidate = get_reranker(cfg, model_name=model_name)
+
+    timings = {}
+    scores = {}
+    for name, reranker in [("torch", reference), (candidate.backend, candidate)]:
+        start = time.perf_counter()
+        scores[name] = reranker.predict(pairs, batch_size=cfg.retrieval.rerank_batch_size)
+        timings[name] = time.perf_counter() - start
+
+    ref, new = scores["torch"], scores[candidate.backend]
+    k = cfg.retrieval.top_k_final
+    correlations, overlaps = [], []
+    offset = 0
+    for texts in candidates:
+        a, b = ref[offset:offset + len(texts)], new[offset:offset + len(texts)]
+        offset += len(texts)
+        if not len(texts):
+            continue
+        correlations.append(spearman(a, b))
+        top_a, top_b = set(np.argsort(-a)[:k]), set(np.argsort(-b)[:k])
+        overlaps.append(len(top_a & top_b) / min(k, len(texts)))
+
+    return {
+        "backend": candidate.backend,
+        "reference": reference.cache_key,
+        "candidate": candidate.cache_key,
+        "pairs": len(pairs),
+        "max_abs_diff": float(np.max(np.abs(ref - new))) if len(pairs) else 0.0,
+        "mean_abs_diff": float(np.mean(np.abs(ref - new))) if len(pairs) else 0.0,
+        "mean_spearman": float(np.mean(correlations)) if correlations else None,
+        f"top{k}_overlap": float(np.mean(overlaps)) if overlaps else None,
+        "reference_ms_per_pair": timings["torch"] * 1000 / max(len(pairs), 1),
+        "candidate_ms_per_pair": timings[candidate.backend] * 1000 / max(len(pairs), 1),
+    }
+
+if __name__ == "__main__":
+    main()
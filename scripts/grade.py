@@ -1,38 +1,50 @@
+import pyrootutils
+root = pyrootutils.setup_root(
+    search_from=__file__,
+    indicator=".project-root",
+    pythonpath=True,
+    dotenv=True,
+)
+
 import pandas as pd
 import os
+import ast
 import glob
+import json
+import argparse
 from ragas import evaluate
 from ragas.metrics import faithfulness, answer_relevancy
+from ragas.run_config import RunConfig
 from datasets import Dataset
 import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
-# NOTE: Code refactored based on : 
-# https://github.com/vibrantlabsai/ragas/issues/2351 
+from src.cache import JudgmentCache
+from src.generation import RETRYABLE_ERRORS
+# NOTE: Code refactored based on :
+# https://github.com/vibrantlabsai/ragas/issues/2351
 # The error was that the rate limits for batch processing on openai requests is restricted. for our api usage
 # WE HAD TO USE THE LLM_FACTORY PATTERN FROM RAGAS TO AVOID THE RATE LIMITS
 
-def evaluate_ragas(results_file):
+METRICS = [faithfulness, answer_relevancy]
+
+def load_results(results_file: str) -> pd.DataFrame:
+    if results_file.endswith(".jsonl"):
+        return pd.read_json(results_file, lines=True, dtype=False)
+    # Results written before the JSONL format: contexts are a Python list literal
     df = pd.read_csv(results_file)
-    # Sample 10% for faster grading (WE ARE BROKE KINDOF SLICING CODE :) KUDOS IF YOU READ THIS)
-    df = df.sample(frac=0.1, random_state=42)
-    
-    # Ragas expects: question, answer (generated), contexts (list of strings), ground_truth
-    # Rename columns to match Ragas requirement
-    ragas_df = df.rename(columns={
-        "generated_answer": "answer",
-        "context": "contexts",
-        "ground_truth": "ground_truth"
-    })
-    
-    # Convert string representation of list back to list
-    ragas_df['contexts'] = ragas_df['contexts'].apply(eval)
-    ragas_df['ground_truth'] = ragas_df['ground_truth'].apply(lambda x: x if isinstance(x, str) else str(x))
-
-    dataset = Dataset.from_pandas(ragas_df)
-    
-    print(f"Running Ragas evaluation on {results_file}...")
-    
+    df["context"] = df["context"].apply(ast.literal_eval)
+    return df
+
+def find_results(pattern: str):
+    """Result files by run ID, preferring JSONL over a legacy CSV of the same run."""
+    files = {}
+    for file in sorted(glob.glob(pattern + ".csv")) + sorted(glob.glob(pattern + ".jsonl")):
+        run_id = os.path.basename(file).rsplit("_results.", 1)[0]
+        files[run_id] = file
+    return files
+
+def build_judge(judge_model: str):
     # Ragas v0.2 Migration: Use llm_factory
     from ragas.llms import llm_factory
     from langchain_openai import OpenAIEmbeddings # Ensure we have embeddings
@@ -49,50 +61,121 @@ def evaluate_ragas(results_file):
     # Use factory pattern with client
     llm = llm_factory(
         provider="openai",
-        model="gpt-4o-mini",
+        model=judge_model,
         client=client
     )
     # Reuse langchain embeddings or potentially ragas factory if available, sticking to langchain for now as user snippet didn't change embeddings
     embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-    
+
     # Adjust strictness
     answer_relevancy.strictness = 1
-    
-    results = evaluate(
-        dataset=dataset,
-        metrics=[faithfulness, answer_relevancy],
-        llm=llm,
-        embeddings=embeddings,
-        raise_exceptions=False,
+    return llm, embeddings
+
+def evaluate_ragas(df: pd.DataFrame, llm, embeddings, run_config: RunConfig, cache: JudgmentCache) -> pd.DataFrame:
+    """Per-row Ragas scores; rows already judged (same content, judge and metric) come from the cache."""
+    ground_truth = df["ground_truth"].apply(lambda x: x if isinstance(x, str) else str(x))
+    hashes = [
+        JudgmentCache.row_hash(q, a, c, g)
+        for q, a, c, g in zip(df["question"], df["generated_answer"], df["context"], ground_truth)
+    ]
+    scores = pd.DataFrame(
+        {metric.name: cache.get_many(metric.name, hashes) for metric in METRICS},
+        index=df.index, dtype=float
     )
-    return results
+
+    # Judge each distinct row with a missing score once
+    pending = {}
+    for i, row_hash in zip(df.index, hashes):
+        if scores.loc[i].isna().any():
+            pending.setdefault(row_hash, i)
+    if pending:
+        rows = df.loc[list(pending.values())]
+        # Ragas expects: question, answer (generated), contexts (list of strings), ground_truth
+        dataset = Dataset.from_dict({
+            "question": rows["question"].tolist(),
+            "answer": rows["generated_answer"].tolist(),
+            "contexts": [list(c) for c in rows["context"]],
+            "ground_truth": ground_truth.loc[rows.index].tolist(),
+        })
+        print(f"Judging {len(dataset)} rows ({len(df) - len(dataset)} cached or duplicate)...")
+        results = evaluate(
+            dataset=dataset,
+            metrics=METRICS,
+            llm=llm,
+            embeddings=embeddings,
+            run_config=run_config,
+            raise_exceptions=False,
+        ).to_pandas()
+        for metric in METRICS:
+            values = results[metric.name].tolist()
+            cache.put_many(metric.name, list(pending), values)
+            judged = dict(zip(pending, values))
+            for i, row_hash in zip(df.index, hashes):
+                if row_hash in judged:
+                    scores.loc[i, metric.name] = judged[row_hash]
+    return scores
 
 def main():
-    results_files = glob.glob("outputs/*_results.csv")
+    parser = argparse.ArgumentParser(description="Ragas grading of benchmark results")
+    parser.add_argument("--results", default="outputs/*_results", help="glob of result files (without extension)")
+    parser.add_argument("--judge", default="gpt-4o-mini", help="judge LLM")
+    parser.add_argument("--max-workers", type=int, default=8, help="concurrent judge requests")
+    parser.add_argument("--max-retries", type=int, default=10, help="retries per request on rate limits/transient errors")
+    parser.add_argument("--max-wait", type=int, default=60, help="max seconds between retries (exponential backoff)")
+    parser.add_argument("--timeout", type=int, default=180, help="seconds per judge request")
+    parser.add_argument("--sample", type=float, default=1.0, help="fraction of rows to grade")
+    parser.add_argument("--cache", default="data/cache/judgments.sqlite", help="judgment cache path")
+    args = parser.parse_args()
+
+    results_files = find_results(args.results)
     if not results_files:
         print("No result files found in outputs/")
         return
 
+    llm, embeddings = build_judge(args.judge)
+    run_config = RunConfig(
+        max_workers=args.max_workers,
+        max_retries=args.max_retries,
+        max_wait=args.max_wait,
+        timeout=args.timeout,
+        # Only back off and retry on rate limits and transient API errors
+        exception_types=RETRYABLE_ERRORS,
+    )
+    cache = JudgmentCache(args.judge, path=args.cache)
+
     all_scores = []
 
-    for file in results_files:
-        run_id = os.path.basename(file).replace("_results.csv", "")
-        ragas_scores = evaluate_ragas(file)
-        
+    for run_id, file in results_files.items():
+        df = load_results(file)
+        print(f"Running Ragas evaluation on {file}...")
+        graded = df.sample(frac=args.sample, random_state=42) if args.sample < 1 else df
+        ragas_scores = evaluate_ragas(graded, llm, embeddings, run_config, cache)
+
         scores = {
             "Run ID": run_id,
-            "Faithfulness": np.mean(ragas_scores["faithfulness"]),
-            "Answer Relevancy": np.mean(ragas_scores["answer_relevancy"])
+            "Faithfulness": ragas_scores["faithfulness"].mean(),
+            "Answer Relevancy": ragas_scores["answer_relevancy"].mean()
         }
-        
-        scores["Tokens/Sec"] = 15.0 # TODO: Add actual tokens/sec
-        
+
+        # Retrieval quality (Ranx) written by benchmark.py
+        retrieval_file = os.path.join(os.path.dirname(file), f"{run_id}_retrieval.json")
+        if os.path.exists(retrieval_file):
+            with open(retrieval_file) as f:
+                scores.update({metric.upper(): value for metric, value in json.load(f).items()})
+
+        # Speed metrics are measured per request by benchmark.py (over all rows, not just the graded ones)
+        for column, name in [("tokens_per_sec", "Tokens/Sec"), ("ttft_s", "TTFT (s)"), ("latency_s", "Latency (s)")]:
+            scores[name] = df[column].mean() if column in df else np.nan
+
         all_scores.append(scores)
 
+    stats = cache.stats()
+    print(f"Judgment cache: {stats['hits']} hits, {stats['misses']} misses")
+
     df_scores = pd.DataFrame(all_scores)
     print("\nFinal Leaderboard:")
     print(df_scores.to_markdown(index=False))
-    
+
     # Save Report
     with open("outputs/report.md", "w") as f:
         f.write("# Benchmark Report\n\n")
@@ -0,0 +1,237 @@
+import pyrootutils
+root = pyrootutils.setup_root(
+    search_from=__file__,
+    indicator=".project-root",
+    pythonpath=True,
+    dotenv=True,
+)
+
+import hydra
+import json
+import time
+import logging
+import asyncio
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from omegaconf import DictConfig
+from src.vector_store import get_vector_store, get_collection_name
+from src.retrieval import HybridRetriever
+from src.generation import InferenceEngine
+from src.tracing import Tracer
+from src.context import get_packer, build_context
+from src.cache import SemanticAnswerCache
+from src.models import REGISTRY
+from src.serving import MicroBatcher, ServiceMetrics, QueueFull
+
+log = logging.getLogger(__name__)
+
+# Long-running query service over an already ingested collection:
+#   python scripts/serve.py serve.port=8000
+#   curl -s localhost:8000/query -d '{"query": "What was 3M revenue in FY2022?"}'
+# GET /health and GET /metrics report readiness and batching/latency stats.
+
+class QueryService:
+    """Retrieval micro-batched across concurrent requests, generation on a shared event loop."""
+
+    def __init__(self, cfg: DictConfig):
+        self.cfg = cfg
+        self.tracer = Tracer(enabled=cfg.tracing.enabled)
+        self.vector_store = get_vector_store(cfg, tracer=self.tracer)
+        self.retriever = HybridRetriever(self.vector_store, cfg, tracer=self.tracer)
+        self.engine = InferenceEngine(cfg, tracer=self.tracer)
+        self.packer = get_packer(cfg)
+        self.answer_cache = None
+        if cfg.answer_cache.enabled:
+            self.answer_cache = SemanticAnswerCache(
+                similarity_threshold=cfg.answer_cache.similarity_threshold,
+                ttl_seconds=cfg.answer_cache.ttl_seconds,
+                max_entries=cfg.answer_cache.max_entries
+            )
+        self.metrics = ServiceMetrics()
+
+        # 1. Encoding, search and reranking run as one batch per collection window
+        if cfg.serve.max_queue >= cfg.serve.max_inflight:
+            # Every queued query is also in flight, so the queue limit could never trigger
+            raise ValueError(f"serve.max_queue ({cfg.serve.max_queue}) must be smaller than "
+                             f"serve.max_inflight ({cfg.serve.max_inflight})")
+        self.batcher = MicroBatcher(
+            self._retrieve_batch,
+            max_batch_size=cfg.serve.max_batch_size,
+            max_wait_ms=cfg.serve.max_wait_ms,
+            max_queue=cfg.serve.max_queue
+        )
+        # 2. LLM calls share one event loop (and InferenceEngine's concurrency limit)
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="generation-loop", daemon=True).start()
+        # 3. Requests beyond max_inflight are rejected instead of queueing
+        self._inflight = threading.BoundedSemaphore(cfg.serve.max_inflight)
+
+    def _retrieve_batch(self, queries):
+        candidates_batch, query_vectors = self.retriever.retrieve_batch(queries, with_query_vectors=True)
+        return list(zip(candidates_batch, query_vectors))
+
+    def warmup(self):
+        """Loads every model a query needs before the first request arrives."""
+        start = time.perf_counter()
+        self.retriever.retrieve_batch(["warmup"])
+        log.info(f"Warmup done in {time.perf_counter() - start:.1f}s")
+
+    def answer(self, query: str, generate: bool = True) -> dict:
+        if not self._inflight.acquire(blocking=False):
+            raise QueueFull(f"{self.cfg.serve.max_inflight} requests in flight")
+        try:
+            start = time.perf_counter()
+            candidates, query_vector = self._wait(self.batcher.submit(query))
+            retrieval_s = time.perf_counter() - start
+            self.metrics.observe("retrieval", retrieval_s)
+
+            context_docs, context_stats = build_context(candidates, self.packer)
+            response = {
+                "query": query,
+                "contexts": [
+                    {"id": doc["id"], "score": doc["score"], "text": doc["text"], "metadata": doc["metadata"]}
+                    for doc in context_docs
+                ],
+                "retrieval_s": retrieval_s,
+                **context_stats,
+            }
+            if not generate:
+                return response
+
+            chunk_ids = [doc["id"] for doc in candidates]
+            cached = self.answer_cache.lookup(query_vector, chunk_ids) if self.answer_cache is not None else None
+            if cached is not None:
+                self.metrics.count("answer_cache_hits")
+                response.update(answer=cached, cache_hit=True)
+            else:
+                generation = self._wait(asyncio.run_coroutine_threadsafe(
+                    self.engine.agenerate_timed(query, context_docs), self.loop
+                ))
+                self.metrics.observe("generation", generation["latency_s"])
+                if generation["ttft_s"] is not None:
+                    self.metrics.observe("ttft", generation["ttft_s"])
+                if self.answer_cache is not None:
+                    self.answer_cache.insert(query_vector, chunk_ids, generation["answer"])
+                response.update(generation, cache_hit=False)
+            self.metrics.observe("total", time.perf_counter() - start)
+            return response
+        finally:
+            self._inflight.release()
+
+    def _wait(self, future: Future):
+        """Waits for ``future``; on timeout it is cancelled so abandoned work
+        (a queued query, or an LLM call holding a concurrency slot) stops too."""
+        try:
+            return future.result(timeout=self.cfg.serve.request_timeout_s)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+
+    def health(self) -> dict:
+        return {
+            "status": "ok",
+            "collection": self.vector_store.collection_name,
+            "points": self.vector_store.count(),
+            "models_loaded": REGISTRY.report(),
+        }
+
+    def stats(self) -> dict:
+        stats = {**self.metrics.snapshot(), "batcher": self.batcher.stats()}
+        stats["embedding_caches"] = self.vector_store.cache_stats()
+        if self.retriever.score_cache is not None:
+            stats["rerank_score_cache"] = self.retriever.score_cache.stats()
+        if self.answer_cache is not None:
+            stats["answer_cache"] = self.answer_cache.stats()
+        if self.tracer.enabled:
+            stats["stages"] = self.tracer.summary()
+        return stats
+
+
+def make_handler(service: QueryService):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: dict, headers: dict = None):
+            payload = json.dumps(body, default=str).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send(200, service.health())
+            elif self.path == "/metrics":
+                self._send(200, service.stats())
+            else:
+                self._send(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self):
+            if self.path != "/query":
+                self._send(404, {"error": f"Unknown path {self.path}"})
+                return
+            service.metrics.count("requests")
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not isinstance(body, dict):
+                    raise ValueError("Request body must be a JSON object")
+                query = body.get("query")
+                if not isinstance(query, str) or not query.strip():
+                    raise ValueError("'query' must be a non-empty string")
+                generate = body.get("generate", True)
+                if not isinstance(generate, bool):
+                    raise ValueError("'generate' must be a boolean")
+            except ValueError as e:
+                service.metrics.count("errors")
+                self._send(400, {"error": str(e)})
+                return
+
+            try:
+                response = service.answer(query, generate=generate)
+            except QueueFull as e:
+                service.metrics.count("rejected")
+                self._send(503, {"error": f"Service busy: {e}"}, headers={"Retry-After": "1"})
+                return
+            except FutureTimeoutError:
+                service.metrics.count("errors")
+                self._send(504, {"error": f"Timed out after {service.cfg.serve.request_timeout_s}s"})
+                return
+            except Exception as e:
+                service.metrics.count("errors")
+                log.exception(f"Query failed: {query!r}")
+                self._send(500, {"error": str(e)})
+                return
+            service.metrics.count("ok")
+            self._send(200, response)
+
+        def log_message(self, format, *args):
+            log.debug(format % args)
+
+    return Handler
+
+
+@hydra.main(version_base=None, config_path="../conf", config_name="config")
+def main(cfg: DictConfig):
+    cfg.qdrant.collection_name = get_collection_name(cfg)
+
+    service = QueryService(cfg)
+    if service.vector_store.count() == 0:
+        log.warning(f"Collection {cfg.qdrant.collection_name} is empty; run scripts/benchmark.py to ingest first.")
+    if cfg.serve.warmup:
+        service.warmup()
+
+    server = ThreadingHTTPServer((cfg.serve.host, cfg.serve.port), make_handler(service))
+    server.daemon_threads = True
+    log.info(f"Serving {cfg.qdrant.collection_name} on http://{cfg.serve.host}:{cfg.serve.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.tracer.close()
+
+if __name__ == "__main__":
+    main()
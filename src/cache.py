@@ -0,0 +1,458 @@
+import os
+import re
+import gzip
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict, namedtuple
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+import numpy as np
+
+# Sparse vectors are cached as plain index/value arrays, independent of the
+# embedding library that produced them.
+SparseArrays = namedtuple("SparseArrays", ["indices", "values"])
+
+
+def normalize_text(text: str) -> str:
+    """Normalizes a query so trivially different spellings share a cache entry."""
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def model_slug(model_name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+
+
+class EmbeddingCache:
+    """Embedding cache keyed by (model name, normalized text).
+
+    Lookups go through an in-memory LRU first and then an append-only on-disk
+    store under ``<cache_dir>/<kind>/<model>/``:
+      - dense: ``vectors.f32`` holds the float32 vectors back to back
+      - sparse: ``indices.i32`` / ``values.f32`` hold the concatenated arrays
+    All files are read through ``np.memmap``; ``index.jsonl`` maps each key to
+    the offset/length of its entry.
+    """
+
+    def __init__(self, model_name: str, kind: str = "dense", cache_dir: Optional[str] = None,
+                 max_memory_items: int = 4096, normalize: bool = True):
+        if kind not in ("dense", "sparse"):
+            raise ValueError(f"Unknown embedding kind {kind}")
+        self.model_name = model_name
+        self.kind = kind
+        self.normalize = normalize
+        self.max_memory_items = max_memory_items
+        self._memory = OrderedDict()
+        self._index = {}
+        self._maps = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.dir = None
+        if cache_dir:
+            self.dir = os.path.join(cache_dir, kind, model_slug(model_name))
+            os.makedirs(self.dir, exist_ok=True)
+            self._load_index()
+
+    def key(self, text: str) -> str:
+        return text_hash(normalize_text(text) if self.normalize else text)
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[Any]]:
+        """Returns the cached embedding for each text, or None on a miss."""
+        found = []
+        for text in texts:
+            key = self.key(text)
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+            elif key in self._index:
+                value = self._read(self._index[key])
+                self._remember(key, value)
+                self.disk_hits += 1
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            found.append(value)
+        return found
+
+    def put_many(self, texts: Sequence[str], values: Sequence[Any]) -> List[Any]:
+        """Stores embeddings and returns them in their cached (numpy) form."""
+        stored, new = [], {}
+        for text, value in zip(texts, values):
+            key = self.key(text)
+            if self.kind == "sparse":
+                value = SparseArrays(
+                    indices=np.asarray(value.indices, dtype=np.int32),
+                    values=np.asarray(value.values, dtype=np.float32)
+                )
+            else:
+                value = np.asarray(value, dtype=np.float32)
+            if self.dir and key not in self._index:
+                new[key] = value
+            self._remember(key, value)
+            stored.append(value)
+        if new:
+            self._append(new)
+        return stored
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "model": self.model_name,
+            "kind": self.kind,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._index) if self.dir else len(self._memory),
+        }
+
+    def _remember(self, key: str, value: Any):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    # --- On-disk store ---
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    def _load_index(self):
+        index_path = self._path("index.jsonl")
+        if not os.path.exists(index_path):
+            return
+        with open(index_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line from an interrupted run; the data it
+                    # pointed at is simply re-encoded next time.
+                    continue
+                self._index[entry.pop("key")] = entry
+
+    def _append(self, values: Dict[str, Any]):
+        """Appends a batch of entries with one write per file (index last)."""
+        if self.kind == "dense":
+            lengths = [value.shape[0] for value in values.values()]
+            start = self._append_array("vectors.f32", np.concatenate(list(values.values())))
+        else:
+            lengths = [value.indices.shape[0] for value in values.values()]
+            start = self._append_array("indices.i32", np.concatenate([value.indices for value in values.values()]))
+            self._append_array("values.f32", np.concatenate([value.values for value in values.values()]))
+        offsets = start + np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        entries = {
+            key: {"offset": int(offset), "length": int(length)}
+            for key, offset, length in zip(values, offsets, lengths)
+        }
+        with open(self._path("index.jsonl"), "a") as f:
+            f.write("".join(json.dumps({"key": key, **entry}) + "\n" for key, entry in entries.items()))
+        self._index.update(entries)
+
+    def _append_array(self, name: str, array: np.ndarray) -> int:
+        """Appends an array to a flat binary file and returns its element offset."""
+        with open(self._path(name), "ab") as f:
+            start = f.tell() // array.itemsize
+            f.write(array.tobytes())
+        return start
+
+    def _mapped(self, name: str, dtype, min_size: int) -> np.ndarray:
+        # The files only grow, so re-map when an entry lies past the current view.
+        mapped = self._maps.get(name)
+        if mapped is None or mapped.shape[0] < min_size:
+            mapped = np.memmap(self._path(name), dtype=dtype, mode="r")
+            self._maps[name] = mapped
+        return mapped
+
+    def _read(self, entry: Dict[str, int]) -> Any:
+        start, end = entry["offset"], entry["offset"] + entry["length"]
+        if self.kind == "dense":
+            vectors = self._mapped("vectors.f32", np.float32, end)
+            return np.array(vectors[start:end])
+        if start == end:
+            return SparseArrays(indices=np.zeros(0, dtype=np.int32), values=np.zeros(0, dtype=np.float32))
+        indices = self._mapped("indices.i32", np.int32, end)
+        values = self._mapped("values.f32", np.float32, end)
+        return SparseArrays(indices=np.array(indices[start:end]), values=np.array(values[start:end]))
+
+
+class RerankScoreCache:
+    """Persistent cross-encoder score cache backed by SQLite.
+
+    Scores are keyed by (reranker model, query hash, chunk content hash), so a
+    re-ingested chunk with unchanged text keeps its score even if its point ID
+    changes. The table is bounded to ``max_entries`` rows; the least recently
+    used rows are evicted first.
+    """
+
+    def __init__(self, model_name: str, path: str, max_entries: int = 1_000_000):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS rerank_scores (
+                model TEXT NOT NULL,
+                query_hash TEXT NOT NULL,
+                chunk_hash TEXT NOT NULL,
+                score REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, query_hash, chunk_hash)
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS rerank_scores_lru ON rerank_scores (last_used)")
+        self._conn.commit()
+
+    def _keys(self, pairs: Sequence[Tuple[str, str]]) -> List[Tuple[str, str, str]]:
+        return [(self.model_name, text_hash(query), text_hash(text)) for query, text in pairs]
+
+    def get_many(self, pairs: Sequence[Tuple[str, str]]) -> List[Optional[float]]:
+        """Returns the cached score of each (query, chunk text) pair, or None on a miss."""
+        keys = self._keys(pairs)
+        found = {}
+        with self._lock:
+            for key in set(keys):
+                row = self._conn.execute(
+                    "SELECT score FROM rerank_scores WHERE model = ? AND query_hash = ? AND chunk_hash = ?",
+                    key
+                ).fetchone()
+                if row is not None:
+                    found[key] = row[0]
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE rerank_scores SET last_used = ? WHERE model = ? AND query_hash = ? AND chunk_hash = ?",
+                    [(now, *key) for key in found]
+                )
+                self._conn.commit()
+
+        scores = [found.get(key) for key in keys]
+        self.hits += sum(score is not None for score in scores)
+        self.misses += sum(score is None for score in scores)
+        return scores
+
+    def put_many(self, pairs: Sequence[Tuple[str, str]], scores: Sequence[float]):
+        now = time.time()
+        rows = [(*key, float(score), now) for key, score in zip(self._keys(pairs), scores)]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO rerank_scores VALUES (?, ?, ?, ?, ?)", rows)
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM rerank_scores").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM rerank_scores WHERE rowid IN "
+                    "(SELECT rowid FROM rerank_scores ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "model": self.model_name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class JudgmentCache:
+    """Persistent LLM-judge scores (e.g. Ragas faithfulness) backed by SQLite.
+
+    Scores are keyed by (judge model, metric, row hash), where the row hash
+    covers the question, generated answer, contexts and ground truth. Grading
+    a results file again only judges rows whose content changed. Failed
+    judgments (NaN) are not stored, so they are retried on the next run.
+    """
+
+    def __init__(self, judge: str, path: str):
+        self.judge = judge
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS judgments (
+                judge TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                row_hash TEXT NOT NULL,
+                score REAL NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (judge, metric, row_hash)
+            )"""
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def row_hash(question: str, answer: str, contexts: Sequence[str], ground_truth: str) -> str:
+        return text_hash(json.dumps([question, answer, list(contexts), ground_truth]))
+
+    def get_many(self, metric: str, row_hashes: Sequence[str]) -> List[Optional[float]]:
+        """Returns the cached score of each row for ``metric``, or None on a miss."""
+        found = {}
+        with self._lock:
+            for row_hash in set(row_hashes):
+                row = self._conn.execute(
+                    "SELECT score FROM judgments WHERE judge = ? AND metric = ? AND row_hash = ?",
+                    (self.judge, metric, row_hash)
+                ).fetchone()
+                if row is not None:
+                    found[row_hash] = row[0]
+
+        scores = [found.get(row_hash) for row_hash in row_hashes]
+        self.hits += sum(score is not None for score in scores)
+        self.misses += sum(score is None for score in scores)
+        return scores
+
+    def put_many(self, metric: str, row_hashes: Sequence[str], scores: Sequence[float]):
+        now = time.time()
+        rows = [
+            (self.judge, metric, row_hash, float(score), now)
+            for row_hash, score in zip(row_hashes, scores)
+            if score is not None and not np.isnan(score)
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO judgments VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "judge": self.judge,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class ParsedDocumentCache:
+    """Content-addressed cache of parsed PDFs.
+
+    Each entry is a gzipped JSONL file named after the PDF's sha256 and a hash
+    of the parser settings, holding one ``{"id", "text", "metadata"}`` record
+    per parsed document.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.dir = cache_dir
+        os.makedirs(self.dir, exist_ok=True)
+
+    def _path(self, file_hash: str, settings: Dict[str, Any]) -> str:
+        settings_hash = text_hash(json.dumps(settings, sort_keys=True))[:12]
+        return os.path.join(self.dir, f"{file_hash}-{settings_hash}.jsonl.gz")
+
+    def get(self, file_hash: str, settings: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        path = self._path(file_hash, settings)
+        if not os.path.exists(path):
+            return None
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def put(self, file_hash: str, settings: Dict[str, Any], records: List[Dict[str, Any]]):
+        path = self._path(file_hash, settings)
+        # Write then rename so an interrupted parse never leaves a partial entry
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        os.replace(tmp_path, path)
+
+
+class SemanticAnswerCache:
+    """In-memory answer cache looked up by query-embedding similarity.
+
+    A cached answer is reused only when the new query's (normalized) dense
+    vector has cosine similarity >= ``similarity_threshold`` with the cached
+    query AND retrieval returned exactly the same chunk IDs, so answers
+    never outlive a re-ingest that changes the context. Entries expire after
+    ``ttl_seconds``; beyond ``max_entries`` the least recently used go first.
+    """
+
+    def __init__(self, similarity_threshold: float = 0.95, ttl_seconds: float = 86400, max_entries: int = 10000):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # Fixed slots: a (max_entries, dim) matrix allocated on the first insert,
+        # so inserts write one row instead of restacking the matrix
+        self._vectors = None
+        self._entries: List[Optional[Tuple[frozenset, str]]] = [None] * max_entries
+        self._valid = np.zeros(max_entries, dtype=bool)
+        self._created = np.zeros(max_entries)
+        self._last_used = np.zeros(max_entries)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def lookup(self, query_vector, chunk_ids: Sequence[Any]) -> Optional[str]:
+        with self._lock:
+            self._expire()
+            if self._vectors is None:
+                self.misses += 1
+                return None
+            similarities = self._vectors @ self._normalize(query_vector)
+            rows = np.flatnonzero(self._valid & (similarities >= self.similarity_threshold))
+            chunk_ids = frozenset(str(chunk_id) for chunk_id in chunk_ids)
+            for row in rows[np.argsort(-similarities[rows])]:
+                cached_ids, answer = self._entries[row]
+                if cached_ids == chunk_ids:
+                    self._last_used[row] = time.time()
+                    self.hits += 1
+                    return answer
+                # Similar query, but the retrieved context changed
+                self.stale += 1
+            self.misses += 1
+            return None
+
+    def insert(self, query_vector, chunk_ids: Sequence[Any], answer: str):
+        now = time.time()
+        vector = self._normalize(query_vector)
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+            free = np.flatnonzero(~self._valid)
+            # Reuse a free slot, else evict the least recently used entry
+            row = free[0] if len(free) else int(np.argmin(self._last_used))
+            self._vectors[row] = vector
+            self._entries[row] = (frozenset(str(chunk_id) for chunk_id in chunk_ids), answer)
+            self._valid[row] = True
+            self._created[row] = now
+            self._last_used[row] = now
+
+    def _expire(self):
+        expired = np.flatnonzero(self._valid & (self._created < time.time() - self.ttl_seconds))
+        self._valid[expired] = False
+        for row in expired:
+            self._entries[row] = None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_matches": self.stale,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": int(self._valid.sum()),
+        }
@@ -0,0 +1,196 @@
+import logging
+from typing import List, Dict, Any, Tuple, Optional
+from src.models import REGISTRY
+
+log = logging.getLogger(__name__)
+
+
+class Tokenizer:
+    """Token counting for the target model: a tiktoken encoding (e.g. ``o200k_base``
+    for gpt-4o) or a Hugging Face tokenizer name (e.g. the Llama 3 one).
+
+    Gated Hugging Face tokenizers (Meta's Llama repos) need an accepted license
+    and ``HF_TOKEN``; without access the ``fallback`` tiktoken encoding is used,
+    which only approximates the model's token counts.
+    """
+
+    def __init__(self, name: str, fallback: str = "cl100k_base"):
+        self.name = name
+        self._hf = None
+        try:
+            import tiktoken
+            self._encoding = tiktoken.get_encoding(name)
+            return
+        except (ImportError, ValueError):
+            pass
+        from transformers import AutoTokenizer
+        try:
+            self._encoding = None
+            self._hf = REGISTRY.get(("tokenizer", name), lambda: AutoTokenizer.from_pretrained(name))
+        except OSError as e:
+            import tiktoken
+            log.warning(f"Tokenizer {name} is unavailable ({e}); approximating token counts with {fallback}.")
+            self.name = fallback
+            self._encoding = tiktoken.get_encoding(fallback)
+
+    def encode(self, text: str) -> List[int]:
+        if self._encoding is not None:
+            return self._encoding.encode(text)
+        return self._hf.encode(text, add_special_tokens=False)
+
+    def decode(self, ids: List[int]) -> str:
+        if self._encoding is not None:
+            return self._encoding.decode(ids)
+        return self._hf.decode(ids)
+
+    def count(self, text: str) -> int:
+        return len(self.encode(text))
+
+
+def _overlap(left: str, right: str, min_chars: int = 32) -> int:
+    """Length of the longest suffix of ``left`` that is a prefix of ``right``."""
+    if len(left) < min_chars or len(right) < min_chars:
+        return 0
+    probe = right[:min_chars]
+    start = left.find(probe)
+    while start != -1:
+        # The earliest match is the longest overlap
+        if right.startswith(left[start:]):
+            return len(left) - start
+        start = left.find(probe, start + 1)
+    return 0
+
+
+class ContextPacker:
+    """Packs retrieved chunks into a token budget before prompting.
+
+    1. Chunks from the same source and page (the 0-based ``page`` every loader
+       sets) are ordered by ``chunk_index`` and adjacent/overlapping ones are
+       stitched into one span (the overlap that fixed-size chunking repeats is
+       kept once).
+    2. Spans fully contained in another span are dropped.
+    3. Chunks are admitted in rerank-score order while the stitched spans of
+       the admitted chunks fit ``token_budget``, so a low-scored neighbour never
+       takes budget ahead of a higher-scored chunk. The first chunk that does
+       not fit is truncated into the remaining budget (if at least
+       ``min_tail_tokens`` remain) as its own last span, and packing stops.
+       Spans are emitted by their best member score.
+    """
+
+    # Per-document lines GOLDEN_PROMPT adds around each chunk
+    HEADER = "Document Source: {source} (Page {page})\nContent:\n\n---\n"
+
+    def __init__(self, tokenizer: Tokenizer, token_budget: int = 2048, min_tail_tokens: int = 64):
+        self.tokenizer = tokenizer
+        self.token_budget = token_budget
+        self.min_tail_tokens = min_tail_tokens
+
+    def _doc_tokens(self, text: str, metadata: Dict[str, Any]) -> int:
+        header = self.HEADER.format(source=metadata.get("source"), page=metadata.get("page_label"))
+        return self.tokenizer.count(header) + self.tokenizer.count(text)
+
+    def _spans(self, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        groups: Dict[Tuple[Any, Any], List[Dict[str, Any]]] = {}
+        for doc in candidates:
+            metadata = doc.get("metadata", {})
+            groups.setdefault((metadata.get("source"), metadata.get("page")), []).append(doc)
+
+        spans = []
+        for docs in groups.values():
+            docs = sorted(docs, key=lambda d: d.get("metadata", {}).get("chunk_index", 0))
+            current = None
+            for doc in docs:
+                score = doc.get("rerank_score", doc.get("score", 0.0))
+                index = doc.get("metadata", {}).get("chunk_index")
+                if current is not None:
+                    overlap = _overlap(current["text"], doc["text"])
+                    adjacent = index is not None and current["last_index"] is not None and index == current["last_index"] + 1
+                    if overlap or adjacent:
+                        separator = "" if overlap else "\n"
+                        current["text"] += separator + doc["text"][overlap:]
+                        current["ids"].append(doc["id"])
+                        current["score"] = max(current["score"], score)
+                        current["last_index"] = index
+                        continue
+                    spans.append(current)
+                current = {
+                    "text": doc["text"],
+                    "ids": [doc["id"]],
+                    "score": score,
+                    "metadata": doc.get("metadata", {}),
+                    "last_index": index,
+                }
+            spans.append(current)
+
+        # Drop exact duplicates and spans contained in a longer one
+        spans.sort(key=lambda span: len(span["text"]), reverse=True)
+        unique = []
+        for span in spans:
+            if any(span["text"] in kept["text"] for kept in unique):
+                continue
+            unique.append(span)
+        return unique
+
+    def pack(self, candidates: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+        """Returns the packed context documents and token accounting for them."""
+        original_tokens = sum(self._doc_tokens(doc["text"], doc.get("metadata", {})) for doc in candidates)
+        counts = {}
+
+        def spans_tokens(spans):
+            for span in spans:
+                if span["text"] not in counts:
+                    counts[span["text"]] = self._doc_tokens(span["text"], span["metadata"])
+            return sum(counts[span["text"]] for span in spans)
+
+        ranked = sorted(candidates, key=lambda doc: doc.get("rerank_score", doc.get("score", 0.0)), reverse=True)
+        selected, used, tail = [], 0, None
+        for doc in ranked:
+            tokens = spans_tokens(self._spans(selected + [doc]))
+            if tokens <= self.token_budget:
+                selected.append(doc)
+                used = tokens
+                continue
+            metadata = doc.get("metadata", {})
+            remaining = self.token_budget - used - (self._doc_tokens(doc["text"], metadata) - self.tokenizer.count(doc["text"]))
+            if remaining >= self.min_tail_tokens:
+                tail = {**doc, "text": self.tokenizer.decode(self.tokenizer.encode(doc["text"])[:remaining])}
+            break
+
+        spans = sorted(self._spans(selected), key=lambda span: span["score"], reverse=True)
+        if tail is not None:
+            tail_span = self._spans([tail])[0]
+            used += self._doc_tokens(tail_span["text"], tail_span["metadata"])
+            spans.append(tail_span)
+
+        packed = [{
+            "id": span["ids"][0],
+            "chunk_ids": span["ids"],
+            "score": span["score"],
+            "rerank_score": span["score"],
+            "text": span["text"],
+            "metadata": span["metadata"],
+        } for span in spans]
+
+        return packed, {
+            "context_tokens": used,
+            "context_tokens_original": original_tokens,
+            "context_tokens_saved": original_tokens - used,
+        }
+
+
+def get_packer(cfg) -> Optional[ContextPacker]:
+    if not cfg.packing.enabled:
+        return None
+    return ContextPacker(
+        Tokenizer(cfg.model.tokenizer),
+        token_budget=cfg.packing.token_budget,
+        min_tail_tokens=cfg.packing.min_tail_tokens
+    )
+
+
+def build_context(candidates: List[Dict[str, Any]], packer: Optional[ContextPacker],
+                  top_n: int = 5) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """The documents handed to the LLM: packed if a packer is configured, else the top ``top_n``."""
+    if packer is None:
+        return candidates[:top_n], {}
+    return packer.pack(candidates)
@@ -0,0 +1,138 @@
+import os
+import random
+import logging
+from typing import List, Dict, Any, Tuple, TYPE_CHECKING
+import numpy as np
+
+if TYPE_CHECKING:
+    from llama_index.core.schema import Document
+
+log = logging.getLogger(__name__)
+
+
+def page_id(metadata: Dict[str, Any]) -> str:
+    """Evidence unit a chunk belongs to: ``<doc_name>#<0-based page>`` (just the
+    document name if the parser did not record a page)."""
+    doc_name = os.path.splitext(os.path.basename(str(metadata.get("source", ""))))[0]
+    page = metadata.get("page")
+    return doc_name if page is None else f"{doc_name}#{page}"
+
+
+def to_run(candidates_batch: List[List[Dict[str, Any]]], query_ids: List[str],
+           doc_level: bool = False) -> Dict[str, Dict[str, float]]:
+    """Turns ranked chunks into a page-level (or document-level) ranx run.
+
+    A page is scored by its best-ranked chunk (1 / rank), so the ranking is
+    the retriever's order whatever the scale of its scores.
+    """
+    run = {}
+    for query_id, candidates in zip(query_ids, candidates_batch):
+        scores = {}
+        for rank, doc in enumerate(candidates):
+            unit = page_id(doc["metadata"])
+            if doc_level:
+                unit = unit.split("#")[0]
+            scores.setdefault(unit, 1 / (rank + 1))
+        run[query_id] = scores
+    return run
+
+
+def financebench_qrels(ds) -> Dict[str, Dict[str, int]]:
+    """Relevant evidence pages per FinanceBench question (query IDs are row indices)."""
+    qrels = {}
+    for i, row in enumerate(ds):
+        relevant = {}
+        for evidence in row["evidence"]:
+            doc_name = evidence.get("doc_name") or row["doc_name"]
+            relevant[f"{doc_name}#{evidence['evidence_page_num']}"] = 1
+        if not relevant:
+            relevant[row["doc_name"]] = 1
+        qrels[str(i)] = relevant
+    return qrels
+
+
+def score_run(qrels: Dict[str, Dict[str, int]], run: Dict[str, Dict[str, float]], k: int = 10) -> Dict[str, float]:
+    """NDCG@k, recall@k and MRR with ranx."""
+    from ranx import Qrels, Run, evaluate
+
+    metrics = [f"ndcg@{k}", f"recall@{k}", "mrr"]
+    # Queries with no retrieved pages still count (as zeros)
+    scores = evaluate(Qrels(qrels), Run(run), metrics, make_comparable=True)
+    return {metric: float(scores[metric]) for metric in metrics}
+
+
+def retrieval_metrics(qrels: Dict[str, Dict[str, int]], candidates_batch: List[List[Dict[str, Any]]],
+                      k: int = 10) -> Dict[str, float]:
+    """Page-level NDCG@k/recall@k/MRR plus document-level recall@k of ranked chunks."""
+    missing_page = sum(doc["metadata"].get("page") is None for candidates in candidates_batch for doc in candidates)
+    if missing_page:
+        # Chunks indexed before parsers recorded pages only match at document level
+        log.warning(f"{missing_page} retrieved chunks have no 'page' metadata; page-level metrics count them as "
+                    "misses. Drop and re-ingest the collection to score them per page.")
+    query_ids = [str(i) for i in range(len(candidates_batch))]
+    metrics = score_run(qrels, to_run(candidates_batch, query_ids), k)
+    doc_qrels = {
+        query_id: {unit.split("#")[0]: 1 for unit in relevant}
+        for query_id, relevant in qrels.items()
+    }
+    doc_scores = score_run(doc_qrels, to_run(candidates_batch, query_ids, doc_level=True), k)
+    metrics[f"doc_recall@{k}"] = doc_scores[f"recall@{k}"]
+    return metrics
+
+
+def latency_stats(seconds: List[float]) -> Dict[str, float]:
+    values = np.array(seconds) * 1000
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+    }
+
+
+COMPANIES = ["Acme", "Borealis", "Cobalt", "Dunmore", "Everline", "Fairholt", "Granite", "Halcyon",
+             "Ironbridge", "Juniper", "Kestrel", "Larchmont", "Meridian", "Northgate", "Oakridge"]
+METRICS = ["revenue", "operating income", "net income", "capital expenditure", "free cash flow",
+           "total debt", "gross margin", "research and development expense", "dividends paid"]
+FILLER = ["The company", "Management", "The board", "Our segment", "The auditor", "The outlook",
+          "reviewed", "expects", "disclosed", "noted", "liquidity", "headwinds", "guidance",
+          "inventory levels", "foreign exchange", "supply chain", "pricing", "restructuring",
+          "during the period", "compared with the prior year", "in the fourth quarter", "across regions"]
+
+
+def synthetic_corpus(num_docs: int = 20, pages_per_doc: int = 10, num_queries: int = 100,
+                     seed: int = 0) -> Tuple[List["Document"], List[str], Dict[str, Dict[str, int]]]:
+    """Offline stand-in for FinanceBench: 10-K-like pages of filler text, each
+    stating a few (company, metric, year) facts, and questions whose
+    relevant pages are the ones stating the asked-for fact. Pages of the same
+    company state other metrics and years, so retrieval has near misses to rank."""
+    from llama_index.core.schema import Document
+
+    rng = random.Random(seed)
+    documents, facts = [], []
+    for d in range(num_docs):
+        company = COMPANIES[d % len(COMPANIES)]
+        year = 2015 + d // len(COMPANIES)
+        doc_name = f"{company.upper()}_{year}_10K"
+        for page in range(pages_per_doc):
+            sentences = [" ".join(rng.choices(FILLER, k=8)) + "." for _ in range(12)]
+            for _ in range(2):
+                metric = rng.choice(METRICS)
+                fact_year = year - rng.randint(0, 2)
+                value = rng.randint(50, 90000)
+                sentences.insert(rng.randrange(len(sentences)),
+                                 f"{company} reported {metric} of ${value:,} million for fiscal {fact_year}.")
+                facts.append((company, metric, fact_year, f"{doc_name}#{page}"))
+            documents.append(Document(text=" ".join(sentences), metadata={
+                "source": f"{doc_name}.pdf",
+                "page": page,
+                "page_label": str(page + 1),
+            }))
+
+    # The same fact may be stated on several pages; all of them are relevant
+    relevant = {}
+    for company, metric, year, unit in facts:
+        relevant.setdefault((company, metric, year), set()).add(unit)
+    keys = rng.sample(sorted(relevant), min(num_queries, len(relevant)))
+    queries = [f"What was {company}'s {metric} in fiscal {year}?" for company, metric, year in keys]
+    qrels = {str(i): {unit: 1 for unit in relevant[key]} for i, key in enumerate(keys)}
+    return documents, queries, qrels
@@ -1,8 +1,16 @@
 import os
-from typing import List, Dict, Any
+import time
+import random
+import asyncio
+import weakref
+from typing import List, Dict, Any, Optional
 from abc import ABC, abstractmethod
-from openai import OpenAI
+from openai import (
+    OpenAI, AsyncOpenAI,
+    RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+)
 from jinja2 import Template
+from src.tracing import Tracer, NULL_TRACER
 
 GOLDEN_PROMPT = """
 You are a financial analyst. Answer the user query based ONLY on the context provided below.
@@ -21,27 +29,37 @@ Query: {{ query }}
 Answer:
 """
 
+# Transient failures worth retrying (rate limits, dropped connections, 5xx)
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
 class InferenceEngine:
-    def __init__(self, cfg):
+    def __init__(self, cfg, tracer: Tracer = None):
         self.cfg = cfg
+        self.tracer = tracer or NULL_TRACER
         self.template = Template(GOLDEN_PROMPT)
         
         if cfg.model.provider == "local":
-            self.client = OpenAI(
-                base_url=cfg.model.endpoint,
-                api_key="sk-no-key-required"
-            )
+            client_kwargs = {"base_url": cfg.model.endpoint, "api_key": "sk-no-key-required"}
             self.model_id = cfg.model.name 
         elif cfg.model.provider == "openai":
-            self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+            client_kwargs = {"api_key": os.getenv("OPENAI_API_KEY")}
             self.model_id = cfg.model.model_id
         else:
             raise ValueError(f"Unknown provider {cfg.model.provider}")
 
-    def generate(self, query: str, context_docs: List[Dict[str, Any]]) -> str:
-        prompt = self.template.render(query=query, documents=context_docs)
-        
-        response = self.client.chat.completions.create(
+        self.client = OpenAI(**client_kwargs)
+        # Retries are handled in agenerate so they can back off without holding a slot
+        self.async_client = AsyncOpenAI(max_retries=0, **client_kwargs)
+        self.concurrency = cfg.model.concurrency
+        self.max_retries = cfg.model.max_retries
+        self.retry_backoff = cfg.model.retry_backoff
+        # One semaphore per event loop (asyncio primitives are loop-bound)
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _request(self, query: str, context_docs: List[Dict[str, Any]]) -> Dict[str, Any]:
+        with self.tracer.span("prompt_render"):
+            prompt = self.template.render(query=query, documents=context_docs)
+        return dict(
             model=self.model_id,
             messages=[
                 {"role": "system", "content": "You are a helpful assistant."},
@@ -50,5 +68,112 @@ class InferenceEngine:
             temperature=self.cfg.model.temperature,
             max_completion_tokens=self.cfg.model.max_tokens # IF USING OLDER OPENAI MODELS CHANGE IT TO max_tokens instead
         )
+
+    def generate(self, query: str, context_docs: List[Dict[str, Any]]) -> str:
+        request = self._request(query, context_docs)
+        with self.tracer.span("llm"):
+            response = self.client.chat.completions.create(**request)
         
         return response.choices[0].message.content
+
+    async def agenerate(self, query: str, context_docs: List[Dict[str, Any]]) -> str:
+        return (await self.agenerate_timed(query, context_docs))["answer"]
+
+    async def agenerate_timed(self, query: str, context_docs: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Async generate that also measures the request.
+
+        Returns the answer together with ``ttft_s`` (time to first token,
+        streaming only), ``latency_s``, ``prompt_tokens``, ``completion_tokens``
+        and ``tokens_per_sec`` (decode rate after the first token).
+
+        At most ``model.concurrency`` requests run at once per event loop.
+        Transient errors are retried up to ``model.max_retries`` times with
+        jittered exponential backoff starting at ``model.retry_backoff`` seconds.
+        """
+        request = self._request(query, context_docs)
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.setdefault(loop, asyncio.Semaphore(self.concurrency))
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with semaphore:
+                    if self.cfg.model.stream:
+                        stats = await self._stream(request)
+                    else:
+                        stats = await self._complete(request)
+                self.tracer.record("llm", stats["latency_s"])
+                if stats["ttft_s"] is not None:
+                    self.tracer.record("llm_ttft", stats["ttft_s"])
+                return stats
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.retry_backoff * (2 ** attempt) * (1 + random.random())
+                print(f"Generation failed ({type(e).__name__}), retrying in {delay:.1f}s...")
+                await asyncio.sleep(delay)
+
+    async def _complete(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        response = await self.async_client.chat.completions.create(**request)
+        latency = time.perf_counter() - start
+        usage = response.usage
+        return self._stats(
+            answer=response.choices[0].message.content,
+            ttft=None,
+            latency=latency,
+            prompt_tokens=usage.prompt_tokens if usage else None,
+            completion_tokens=usage.completion_tokens if usage else None
+        )
+
+    async def _stream(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        ttft = None
+        parts = []
+        content_chunks = 0
+        usage = None
+        stream = await self.async_client.chat.completions.create(
+            stream=True,
+            stream_options={"include_usage": True},
+            **request
+        )
+        async for chunk in stream:
+            if chunk.usage is not None:
+                # Final chunk when include_usage is honoured
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                parts.append(delta)
+                content_chunks += 1
+        latency = time.perf_counter() - start
+
+        return self._stats(
+            answer="".join(parts),
+            ttft=ttft,
+            latency=latency,
+            prompt_tokens=usage.prompt_tokens if usage else None,
+            # Servers that omit usage stream roughly one token per chunk
+            completion_tokens=usage.completion_tokens if usage else content_chunks
+        )
+
+    @staticmethod
+    def _stats(answer: str, ttft: Optional[float], latency: float,
+               prompt_tokens: Optional[int], completion_tokens: Optional[int]) -> Dict[str, Any]:
+        tokens_per_sec = None
+        if completion_tokens:
+            if ttft is not None and completion_tokens > 1 and latency > ttft:
+                # Decode rate: tokens after the first one over the time after the first one
+                tokens_per_sec = (completion_tokens - 1) / (latency - ttft)
+            elif latency > 0:
+                tokens_per_sec = completion_tokens / latency
+        return {
+            "answer": answer,
+            "ttft_s": ttft,
+            "latency_s": latency,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "tokens_per_sec": tokens_per_sec,
+        }
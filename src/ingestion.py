@@ -1,36 +1,223 @@
 import os
+import json
+import hashlib
+from uuid import uuid5, NAMESPACE_URL
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any
-from llama_parse import LlamaParse
-from llama_index.core.node_parser import SentenceSplitter, SemanticSplitterNodeParser
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Tuple
 from llama_index.core.schema import Document
 from omegaconf import DictConfig
-import nest_asyncio
+import numpy as np
+from src.cache import ParsedDocumentCache, EmbeddingCache
+from src.models import get_dense_model
 
-nest_asyncio.apply()
+# Parser and chunker dependencies (llama_parse, node parsers) are imported
+# where they are first needed, so runs that skip ingestion never load them.
 
-class PDFLoader:
-    def __init__(self, api_key: str = None):
+class Loader(ABC):
+    """Turns a PDF into Documents, with parsed output cached by content hash."""
+
+    # Bumped when the Document metadata changes (2: 0-based "page" index),
+    # so parses cached by an older version are not reused
+    SCHEMA_VERSION = 2
+
+    def __init__(self, settings: Dict[str, Any], cache_dir: str = None):
+        # Settings that change the parser output; part of the parse cache key
+        self.settings = {**settings, "schema": self.SCHEMA_VERSION}
+        self.cache = ParsedDocumentCache(cache_dir) if cache_dir else None
+
+    def load(self, file_path: str, file_hash: str = None) -> List[Document]:
+        """Loads a PDF and returns a list of Documents.
+
+        Parsed output is cached in ``cache_dir`` by PDF content hash, so the
+        parser only runs once per distinct file and parser setting.
+        """
+        if self.cache is not None:
+            file_hash = file_hash or file_sha256(file_path)
+            records = self.cache.get(file_hash, self.settings)
+            if records is not None:
+                print(f"Loaded cached parse of {file_path}")
+                return [self._from_record(record, file_path) for record in records]
+
+        documents = self._parse(file_path)
+
+        if self.cache is not None:
+            self.cache.put(file_hash, self.settings, [
+                {"id": doc.id_, "text": doc.text, "metadata": doc.metadata} for doc in documents
+            ])
+        return documents
+
+    @abstractmethod
+    def _parse(self, file_path: str) -> List[Document]:
+        pass
+
+    @staticmethod
+    def _from_record(record: Dict[str, Any], file_path: str) -> Document:
+        metadata = dict(record["metadata"])
+        # The same content may now live under a different path
+        metadata["source"] = file_path
+        return Document(id_=record["id"], text=record["text"], metadata=metadata)
+
+class PDFLoader(Loader):
+    def __init__(self, api_key: str = None, result_type: str = "markdown", cache_dir: str = None):
+        super().__init__({"parser": "llamaparse", "result_type": result_type}, cache_dir=cache_dir)
         self.api_key = api_key or os.getenv("LLAMA_CLOUD_API_KEY")
-        if not self.api_key:
-            raise ValueError("LLAMA_CLOUD_API_KEY is required for LlamaParse")
-        
-        self.parser = LlamaParse(
-            api_key=self.api_key,
-            result_type="markdown",
-            verbose=True
-        )
+        self._parser = None
+
+    @property
+    def parser(self):
+        # Only needed (and only requires an API key) on a parse cache miss
+        if self._parser is None:
+            if not self.api_key:
+                raise ValueError("LLAMA_CLOUD_API_KEY is required for LlamaParse")
+            import nest_asyncio
+            from llama_parse import LlamaParse
 
-    def load(self, file_path: str) -> List[Document]:
-        """Loads a PDF and returns a list of Documents (usually 1 per PDF with markdown content)."""
+            nest_asyncio.apply()
+            self._parser = LlamaParse(
+                api_key=self.api_key,
+                result_type=self.settings["result_type"],
+                split_by_page=True,
+                verbose=True
+            )
+        return self._parser
+
+    def _parse(self, file_path: str) -> List[Document]:
         print(f"Parsing {file_path} with LlamaParse...")
         documents = self.parser.load_data(file_path)
-        # Ensure metadata is preserved/added if needed
-        for doc in documents:
+        # Ensure metadata is preserved/added if needed (split_by_page: one Document per page, in order)
+        for page, doc in enumerate(documents):
             doc.metadata["source"] = file_path
+            doc.metadata["page"] = page
+        return documents
+
+def _extract_pages(file_path: str, engine: str, page_numbers: List[int]) -> List[Tuple[int, str]]:
+    """Worker: extracts the text of a range of pages (0-based) from a PDF."""
+    from pypdf import PdfReader, PdfWriter
+
+    reader = PdfReader(file_path)
+    if engine == "pypdf":
+        return [(i, reader.pages[i].extract_text() or "") for i in page_numbers]
+
+    # unstructured has no page-range option, so hand it just the pages of this task
+    from io import BytesIO
+    from unstructured.partition.pdf import partition_pdf
+
+    writer = PdfWriter()
+    for i in page_numbers:
+        writer.add_page(reader.pages[i])
+    buffer = BytesIO()
+    writer.write(buffer)
+    buffer.seek(0)
+
+    texts = {i: [] for i in page_numbers}
+    for element in partition_pdf(file=buffer, strategy="fast"):
+        page = page_numbers[(element.metadata.page_number or 1) - 1]
+        text = f"## {element.text}" if element.category == "Title" else element.text
+        texts[page].append(text)
+    return [(i, "\n\n".join(texts[i])) for i in page_numbers]
+
+class LocalPDFLoader(Loader):
+    """Offline parser backend: one Document per page, pages parsed across a process pool."""
+
+    def __init__(self, engine: str = "pypdf", workers: int = None, pages_per_task: int = 8, cache_dir: str = None):
+        if engine not in ("pypdf", "unstructured"):
+            raise ValueError(f"Unknown local parser engine: {engine}")
+        super().__init__({"parser": "local", "engine": engine}, cache_dir=cache_dir)
+        self.engine = engine
+        self.workers = workers or os.cpu_count()
+        self.pages_per_task = pages_per_task
+        self._pool = None
+
+    def _parse(self, file_path: str) -> List[Document]:
+        from pypdf import PdfReader
+
+        print(f"Parsing {file_path} with {self.engine} ({self.workers} workers)...")
+        reader = PdfReader(file_path)
+        num_pages = len(reader.pages)
+        # Same labels a PDF viewer shows (e.g. "iv", "12"), as used in GOLDEN_PROMPT
+        page_labels = reader.page_labels
+
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        tasks = [
+            list(range(start, min(start + self.pages_per_task, num_pages)))
+            for start in range(0, num_pages, self.pages_per_task)
+        ]
+        futures = [self._pool.submit(_extract_pages, file_path, self.engine, pages) for pages in tasks]
+
+        documents = []
+        for future in futures:
+            for page, text in future.result():
+                if not text.strip():
+                    continue
+                documents.append(Document(text=text, metadata={
+                    "source": file_path,
+                    "page": page, # 0-based page index (FinanceBench evidence_page_num)
+                    "page_label": page_labels[page] if page < len(page_labels) else str(page + 1),
+                }))
         return documents
 
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def assign_chunk_ids(nodes: List[Any], doc_hash: str) -> List[Any]:
+    """Gives nodes deterministic IDs derived from the document hash and chunk position.
+
+    Re-ingesting an unchanged document therefore overwrites the same points
+    instead of adding duplicates, and every point carries ``doc_hash`` so a
+    document's chunks can be deleted together.
+    """
+    for position, node in enumerate(nodes):
+        node.id_ = str(uuid5(NAMESPACE_URL, f"{doc_hash}:{position}"))
+        node.metadata["doc_hash"] = doc_hash
+        node.metadata["chunk_index"] = position
+    return nodes
+
+class IngestionManifest:
+    """Per-collection record of which PDFs (by content hash) have been indexed."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.files = json.load(f)["files"]
+
+    def diff(self, current: Dict[str, str]) -> Tuple[List[str], List[str]]:
+        """Compares ``{file_path: sha256}`` against the manifest.
+
+        Returns the paths that are new or changed, and the manifest entries
+        (file names) that were removed.
+        """
+        current_names = {os.path.basename(path): path for path in current}
+        changed = [
+            path for name, path in current_names.items()
+            if self.files.get(name, {}).get("sha256") != current[path]
+        ]
+        removed = [name for name in self.files if name not in current_names]
+        return changed, removed
+
+    def record(self, file_path: str, sha256: str, num_chunks: int):
+        self.files[os.path.basename(file_path)] = {"sha256": sha256, "chunks": num_chunks}
+
+    def remove(self, name: str):
+        self.files.pop(name, None)
+
+    def clear(self):
+        self.files = {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"files": self.files}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
 class Chunker(ABC):
     @abstractmethod
     def chunk(self, documents: List[Document]) -> List[Any]:
@@ -38,6 +225,8 @@ class Chunker(ABC):
 
 class FixedChunker(Chunker):
     def __init__(self, chunk_size: int = 512, chunk_overlap: int = 50):
+        from llama_index.core.node_parser import SentenceSplitter
+
         self.splitter = SentenceSplitter(
             chunk_size=chunk_size, 
             chunk_overlap=chunk_overlap
@@ -47,18 +236,97 @@ class FixedChunker(Chunker):
         nodes = self.splitter.get_nodes_from_documents(documents)
         return nodes
 
+# Per-process sentence tokenizer (loading punkt is not free)
+_sentence_splitter = None
+
+def _split_sentences(text: str) -> List[str]:
+    """Worker: splits a document into sentences the way SemanticSplitterNodeParser does."""
+    from llama_index.core.node_parser.text.utils import split_by_sentence_tokenizer
+
+    global _sentence_splitter
+    if _sentence_splitter is None:
+        _sentence_splitter = split_by_sentence_tokenizer()
+    return _sentence_splitter(text)
+
 class SemanticChunker(Chunker):
-    def __init__(self, breakpoint_percentile_threshold: int = 95, buffer_size: int = 1, embed_model_name: str = "BAAI/bge-m3"):
-        storage_dir = os.environ.get("HF_HOME", "./models") # Ensure we don't redownload unnecessarily
-        embed_model = HuggingFaceEmbedding(model_name=embed_model_name, cache_folder=storage_dir)
-        self.splitter = SemanticSplitterNodeParser(
-            buffer_size=buffer_size, 
-            breakpoint_percentile_threshold=breakpoint_percentile_threshold, 
-            embed_model=embed_model
+    """Embedding-similarity chunking (same algorithm as SemanticSplitterNodeParser).
+
+    1. Documents are split into sentences across a process pool.
+    2. The sentence windows (each sentence with ``buffer_size`` neighbours) of
+       all documents are embedded together in large batches; embeddings are
+       cached on disk by window text, so re-chunking with another threshold
+       (or re-ingesting unchanged pages) does not re-embed anything.
+    3. Cosine distances between consecutive windows are computed in one
+       NumPy pass per document, and a chunk ends wherever the distance
+       exceeds the document's ``breakpoint_percentile_threshold`` percentile.
+    """
+
+    def __init__(self, breakpoint_percentile_threshold: int = 95, buffer_size: int = 1,
+                 embed_model_name: str = "BAAI/bge-m3", cache_dir: str = None,
+                 workers: int = None, batch_size: int = 128):
+        self.breakpoint_percentile_threshold = breakpoint_percentile_threshold
+        self.buffer_size = buffer_size
+        # Same registry instance the vector store embeds chunks and queries with
+        self.embed_model_name = embed_model_name
+        self.batch_size = batch_size
+        self.workers = workers or os.cpu_count()
+        self._pool = None
+        # Keyed by the exact window text (no query normalization), apart from the query cache
+        self.cache = EmbeddingCache(
+            embed_model_name, kind="dense", normalize=False,
+            cache_dir=os.path.join(cache_dir, "chunking") if cache_dir else None
         )
 
+    def _sentences(self, documents: List[Document]) -> List[List[str]]:
+        texts = [doc.text for doc in documents]
+        if self.workers <= 1 or len(texts) <= 1:
+            return [_split_sentences(text) for text in texts]
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return list(self._pool.map(_split_sentences, texts, chunksize=max(1, len(texts) // (4 * self.workers))))
+
+    def _windows(self, sentences: List[str]) -> List[str]:
+        return [
+            "".join(sentences[max(0, i - self.buffer_size):i + self.buffer_size + 1])
+            for i in range(len(sentences))
+        ]
+
+    def _embed(self, windows: List[str]) -> Dict[str, np.ndarray]:
+        """Unit-length embeddings of distinct windows, from the cache where possible."""
+        unique = list(dict.fromkeys(windows))
+        cached = self.cache.get_many(unique)
+        missing = [text for text, vector in zip(unique, cached) if vector is None]
+        if missing:
+            vectors = get_dense_model(self.embed_model_name).encode(
+                missing, batch_size=self.batch_size, convert_to_numpy=True, normalize_embeddings=True
+            )
+            stored = iter(self.cache.put_many(missing, vectors))
+            cached = [vector if vector is not None else next(stored) for vector in cached]
+        return dict(zip(unique, cached))
+
+    def _split_points(self, embeddings: np.ndarray) -> np.ndarray:
+        """Indices of the sentences that end a chunk (excluding the last sentence)."""
+        if len(embeddings) < 2:
+            return np.zeros(0, dtype=np.int64)
+        distances = 1 - np.einsum("ij,ij->i", embeddings[:-1], embeddings[1:])
+        threshold = np.percentile(distances, self.breakpoint_percentile_threshold)
+        return np.flatnonzero(distances > threshold)
+
     def chunk(self, documents: List[Document]) -> List[Any]:
-        nodes = self.splitter.get_nodes_from_documents(documents)
+        from llama_index.core.node_parser.node_utils import build_nodes_from_splits
+
+        sentences_per_doc = self._sentences(documents)
+        windows_per_doc = [self._windows(sentences) for sentences in sentences_per_doc]
+        embeddings = self._embed([window for windows in windows_per_doc for window in windows])
+
+        nodes = []
+        for doc, sentences, windows in zip(documents, sentences_per_doc, windows_per_doc):
+            if not sentences:
+                continue
+            matrix = np.stack([embeddings[window] for window in windows])
+            bounds = [0, *(self._split_points(matrix) + 1).tolist(), len(sentences)]
+            splits = ["".join(sentences[start:end]) for start, end in zip(bounds[:-1], bounds[1:]) if start < end]
+            nodes.extend(build_nodes_from_splits(splits, doc))
         return nodes
 
 def get_chunker(cfg: DictConfig) -> Chunker:
@@ -70,7 +338,24 @@ def get_chunker(cfg: DictConfig) -> Chunker:
     elif cfg.chunking.strategy == "semantic":
         return SemanticChunker(
             breakpoint_percentile_threshold=cfg.chunking.breakpoint_percentile_threshold,
-            buffer_size=cfg.chunking.buffer_size
+            buffer_size=cfg.chunking.buffer_size,
+            embed_model_name=cfg.retrieval.dense_model,
+            cache_dir=cfg.cache.dir if cfg.chunking.cache_embeddings else None,
+            workers=cfg.chunking.workers,
+            batch_size=cfg.chunking.embed_batch_size
         )
     else:
         raise ValueError(f"Unknown chunking strategy: {cfg.chunking.strategy}")
+
+def get_loader(cfg: DictConfig, cache_dir: str = None) -> Loader:
+    if cfg.parser.backend == "llamaparse":
+        return PDFLoader(result_type=cfg.parser.result_type, cache_dir=cache_dir)
+    elif cfg.parser.backend == "local":
+        return LocalPDFLoader(
+            engine=cfg.parser.engine,
+            workers=cfg.parser.workers,
+            pages_per_task=cfg.parser.pages_per_task,
+            cache_dir=cache_dir
+        )
+    else:
+        raise ValueError(f"Unknown parser backend: {cfg.parser.backend}")
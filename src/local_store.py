@@ -0,0 +1,350 @@
+import os
+import json
+import time
+from typing import List, Dict, Any, Optional, Iterable
+import numpy as np
+from qdrant_client import models
+from omegaconf import DictConfig
+from src.vector_store import HybridQdrantClient
+from src.tracing import Tracer
+
+
+class LocalVectorStore(HybridQdrantClient):
+    """In-process exact-search backend with the same contract as HybridQdrantClient.
+
+    Selected with ``qdrant.host: local``. Each collection lives in
+    ``<qdrant.local_path>/<collection>/``:
+      - ``dense.bin``: (rows, dim) L2-normalized matrix in ``qdrant.local_dtype``,
+        searched with one matrix multiply per query batch
+      - ``rows.bin``: fixed-size record per point (ID, ``doc_hash`` and offsets
+        into the files below)
+      - ``sparse_{indices,values}.bin``: per-point SPLADE vectors
+      - ``payloads.bin``: JSON payloads, decoded only for returned hits
+      - ``inv_<segment>_{indptr,rows,values}.npy``: CSR inverted indexes
+        (term -> postings), one segment per ingest
+    Everything is memory-mapped on startup; nothing is parsed, re-embedded or
+    rebuilt. Appends only write their own rows and posting segment; all files
+    are rewritten only when rows are deleted or segments pile up.
+    """
+
+    SCORE_BLOCK_ROWS = 65536
+    # Posting segments are merged into one beyond this many
+    MAX_SEGMENTS = 8
+    FORMAT = 2
+    ROW_DTYPE = np.dtype([
+        ("id", "S36"), ("doc_hash", "S64"),
+        ("sparse_offset", "<i8"), ("sparse_length", "<i8"),
+        ("payload_offset", "<i8"), ("payload_length", "<i8"),
+    ])
+
+    def __init__(self, cfg: DictConfig, tracer: Optional[Tracer] = None):
+        self.dtype = np.dtype(cfg.qdrant.local_dtype)
+        self.root = os.path.join(cfg.qdrant.local_path, cfg.qdrant.collection_name)
+        super().__init__(cfg, tracer=tracer)
+
+    def _connect(self, cfg: DictConfig):
+        return None
+
+    # --- Storage ---
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def _ensure_collection(self):
+        os.makedirs(self.root, exist_ok=True)
+        if os.path.exists(self._path("points.jsonl")):
+            raise ValueError(f"{self.root} was written by an older LocalVectorStore; delete it to re-ingest.")
+        self.dim, self.num_rows, self.segments = None, 0, []
+        if os.path.exists(self._path("meta.json")):
+            with open(self._path("meta.json")) as f:
+                meta = json.load(f)
+            self.dim, self.num_rows, self.segments = meta["dim"], meta["count"], meta["segments"]
+            # Drop rows a crashed ingest appended after the last commit (row files are positional)
+            os.truncate(self._path("dense.bin"), self.num_rows * self.dim * self.dtype.itemsize)
+            os.truncate(self._path("rows.bin"), self.num_rows * self.ROW_DTYPE.itemsize)
+        self._indexed_rows = self.num_rows
+        self._new_rows: Dict[str, int] = {}
+        self._deleted = set()
+        self._load_arrays()
+
+    def _load_arrays(self):
+        self.dense = self._memmap("dense.bin", self.dtype, (-1, self.dim) if self.dim else None)
+        self.rows = self._memmap("rows.bin", self.ROW_DTYPE)
+        self.payload_data = self._memmap("payloads.bin", np.uint8)
+        self.postings = [
+            tuple(self._load_npy(f"inv_{segment}_{part}.npy") for part in ("indptr", "rows", "values"))
+            for segment in self.segments
+        ]
+
+    def _memmap(self, name: str, dtype, shape=None) -> Optional[np.ndarray]:
+        path = self._path(name)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return None
+        array = np.memmap(path, dtype=dtype, mode="r")
+        return array.reshape(shape) if shape else array
+
+    def _load_npy(self, name: str) -> Optional[np.ndarray]:
+        path = self._path(name)
+        return np.load(path, mmap_mode="r") if os.path.exists(path) else None
+
+    def _point_id(self, row: int) -> str:
+        return self.rows["id"][row].decode()
+
+    def _payload(self, row: int) -> Dict[str, Any]:
+        record = self.rows[row]
+        start = record["payload_offset"]
+        return json.loads(self.payload_data[start:start + record["payload_length"]].tobytes())
+
+    def count(self) -> int:
+        return self.num_rows - len(self._deleted)
+
+    def delete_documents(self, doc_hashes: List[str]):
+        if not doc_hashes or self.rows is None:
+            return
+        matches = np.isin(self.rows["doc_hash"], [doc_hash.encode() for doc_hash in doc_hashes])
+        self._deleted.update(np.flatnonzero(matches).tolist())
+        self._commit()
+
+    def index(self, nodes: Iterable[Any], batch_size: Optional[int] = None) -> int:
+        total = super().index(nodes, batch_size=batch_size)
+        self._commit()
+        return total
+
+    def _upsert(self, points: List[models.PointStruct]):
+        dense = np.asarray([point.vector["dense"] for point in points], dtype=np.float32)
+        dense /= np.maximum(np.linalg.norm(dense, axis=1, keepdims=True), 1e-12)
+        if self.dim is None:
+            self.dim = dense.shape[1]
+        with open(self._path("dense.bin"), "ab") as f:
+            f.write(dense.astype(self.dtype).tobytes())
+
+        # Points re-upserted under an existing ID replace their old row on commit
+        point_ids = [str(point.id) for point in points]
+        if self.rows is not None:
+            existing = np.isin(self.rows["id"], [point_id.encode() for point_id in point_ids])
+            self._deleted.update(np.flatnonzero(existing).tolist())
+
+        records = np.zeros(len(points), dtype=self.ROW_DTYPE)
+        with open(self._path("sparse_indices.bin"), "ab") as fi, \
+             open(self._path("sparse_values.bin"), "ab") as fv, \
+             open(self._path("payloads.bin"), "ab") as fp:
+            sparse_offset, payload_offset = fi.tell() // 4, fp.tell()
+            for i, (point, point_id) in enumerate(zip(points, point_ids)):
+                sparse = point.vector.get("sparse")
+                indices = np.asarray(sparse.indices if sparse else [], dtype=np.int32)
+                values = np.asarray(sparse.values if sparse else [], dtype=np.float32)
+                fi.write(indices.tobytes())
+                fv.write(values.tobytes())
+                payload = json.dumps(point.payload).encode()
+                fp.write(payload)
+
+                doc_hash = str(point.payload.get("doc_hash", ""))
+                if len(point_id) > 36 or len(doc_hash) > 64:
+                    raise ValueError(f"Point {point_id!r}: IDs must be UUIDs and doc_hash a hex digest")
+                records[i] = (point_id, doc_hash, sparse_offset, len(indices), payload_offset, len(payload))
+                sparse_offset += len(indices)
+                payload_offset += len(payload)
+
+                if point_id in self._new_rows:
+                    self._deleted.add(self._new_rows[point_id])
+                self._new_rows[point_id] = self.num_rows + i
+        with open(self._path("rows.bin"), "ab") as f:
+            f.write(records.tobytes())
+        self.num_rows += len(points)
+
+    def _commit(self):
+        """Makes writes visible: compacts deleted rows away (rebuilding the
+        inverted index), or indexes just the appended rows as a new segment."""
+        if not self._deleted and self._indexed_rows == self.num_rows:
+            return
+        stale_segments = []
+        if self._deleted:
+            self._compact()
+            stale_segments = self._reset_segments()
+        elif len(self.segments) >= self.MAX_SEGMENTS:
+            stale_segments = self._reset_segments()
+        else:
+            self._add_segment(self._indexed_rows, self.num_rows)
+        self._indexed_rows = self.num_rows
+        self._new_rows = {}
+        if self.dim is not None:
+            with open(self._path("meta.json"), "w") as f:
+                json.dump({"format": self.FORMAT, "dim": self.dim, "dtype": self.dtype.name,
+                           "count": self.num_rows, "segments": self.segments}, f)
+        # Old segments are removed only once meta.json no longer lists them
+        for segment in stale_segments:
+            for part in ("indptr", "rows", "values"):
+                os.remove(self._path(f"inv_{segment}_{part}.npy"))
+        self._load_arrays()
+
+    def _compact(self):
+        keep = np.setdiff1d(np.arange(self.num_rows), np.fromiter(self._deleted, dtype=np.int64))
+        dense = self._memmap("dense.bin", self.dtype, (-1, self.dim))
+        rows = self._memmap("rows.bin", self.ROW_DTYPE)
+        sparse_indices = self._memmap("sparse_indices.bin", np.int32)
+        sparse_values = self._memmap("sparse_values.bin", np.float32)
+        payload_data = self._memmap("payloads.bin", np.uint8)
+
+        tmp = {name: self._path(name + ".tmp") for name in
+               ("dense.bin", "rows.bin", "sparse_indices.bin", "sparse_values.bin", "payloads.bin")}
+        records = np.array(rows[keep])
+        with open(tmp["dense.bin"], "wb") as fd, open(tmp["sparse_indices.bin"], "wb") as fi, \
+             open(tmp["sparse_values.bin"], "wb") as fv, open(tmp["payloads.bin"], "wb") as fp:
+            for start in range(0, len(keep), self.SCORE_BLOCK_ROWS):
+                fd.write(np.asarray(dense[keep[start:start + self.SCORE_BLOCK_ROWS]]).tobytes())
+            sparse_offset, payload_offset = 0, 0
+            for record in records:
+                start, length = record["sparse_offset"], record["sparse_length"]
+                if length:
+                    fi.write(np.asarray(sparse_indices[start:start + length]).tobytes())
+                    fv.write(np.asarray(sparse_values[start:start + length]).tobytes())
+                start = record["payload_offset"]
+                fp.write(np.asarray(payload_data[start:start + record["payload_length"]]).tobytes())
+                record["sparse_offset"], record["payload_offset"] = sparse_offset, payload_offset
+                sparse_offset += length
+                payload_offset += record["payload_length"]
+        with open(tmp["rows.bin"], "wb") as f:
+            f.write(records.tobytes())
+
+        # Release the maps before replacing the files underneath them
+        del dense, rows, sparse_indices, sparse_values, payload_data
+        self.dense = self.rows = self.payload_data = None
+        for name, tmp_path in tmp.items():
+            os.replace(tmp_path, self._path(name))
+        self.num_rows = len(records)
+        self._deleted = set()
+
+    def _reset_segments(self) -> List[int]:
+        """Indexes every row as one new posting segment; returns the replaced segments."""
+        old = self.segments
+        self.postings, self.segments = [], []
+        self._add_segment(0, self.num_rows, segment=max(old, default=-1) + 1)
+        return old
+
+    def _add_segment(self, start_row: int, end_row: int, segment: Optional[int] = None):
+        """Writes the CSR inverted index of rows ``[start_row, end_row)`` as a new segment."""
+        if not self.use_sparse or end_row <= start_row:
+            return
+        records = self._memmap("rows.bin", self.ROW_DTYPE)[start_row:end_row]
+        lengths = records["sparse_length"]
+        start = int(records["sparse_offset"][0])
+        end = int(records["sparse_offset"][-1] + lengths[-1])
+        # Rows are appended (and compacted) in order, so their sparse vectors are contiguous
+        indices = np.asarray(self._memmap("sparse_indices.bin", np.int32)[start:end]) \
+            if end > start else np.zeros(0, dtype=np.int32)
+        values = np.asarray(self._memmap("sparse_values.bin", np.float32)[start:end]) \
+            if end > start else np.zeros(0, dtype=np.float32)
+        rows = np.repeat(np.arange(start_row, end_row, dtype=np.int32), lengths)
+
+        # Sort postings by term to get a CSR matrix with terms as rows
+        order = np.argsort(indices, kind="stable")
+        terms = indices[order]
+        vocab = int(terms[-1]) + 1 if len(terms) else 0
+        indptr = np.zeros(vocab + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=vocab), out=indptr[1:])
+
+        if segment is None:
+            segment = max(self.segments, default=-1) + 1
+        np.save(self._path(f"inv_{segment}_indptr.npy"), indptr)
+        np.save(self._path(f"inv_{segment}_rows.npy"), rows[order])
+        np.save(self._path(f"inv_{segment}_values.npy"), values[order])
+        self.segments.append(segment)
+
+    def index_report(self, queries: List[str], top_k: int = 20) -> Dict[str, Any]:
+        # Exact search by construction; the dense matrix is the only large array
+        dense_gen = self.encode_dense(queries)
+        start = time.perf_counter()
+        self._dense_search_batch(dense_gen, top_k)
+        search_s = time.perf_counter() - start
+        dense_bytes = self.dense.nbytes if self.dense is not None else 0
+        return {
+            "quantization": self.dtype.name,
+            "on_disk": True,
+            "points": self.count(),
+            f"recall@{top_k}_vs_exact": 1.0,
+            "dense_search_ms_per_query": search_s * 1000 / len(queries),
+            "est_vector_ram_mb": dense_bytes / 2**20,
+            "est_vector_disk_mb": dense_bytes / 2**20,
+        }
+
+    # --- Search ---
+
+    def _to_points(self, rows: np.ndarray, scores: np.ndarray) -> List[models.ScoredPoint]:
+        return [
+            models.ScoredPoint(id=self._point_id(row), version=0, score=float(score), payload=self._payload(row))
+            for row, score in zip(rows, scores)
+        ]
+
+    def _top_k_rows(self, scores: np.ndarray, top_k: int) -> List[np.ndarray]:
+        """Top-k rows per query from a (queries, rows) score matrix, best first."""
+        k = min(top_k, scores.shape[1])
+        if k == 0:
+            return [np.zeros(0, dtype=np.int64) for _ in range(scores.shape[0])]
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for query_scores, rows in zip(scores, top):
+            rows = rows[np.argsort(-query_scores[rows], kind="stable")]
+            results.append(rows[np.isfinite(query_scores[rows])])
+        return results
+
+    def _top_k(self, scores: np.ndarray, top_k: int) -> List[List[models.ScoredPoint]]:
+        return [self._to_points(rows, query_scores[rows])
+                for query_scores, rows in zip(scores, self._top_k_rows(scores, top_k))]
+
+    def _dense_scores(self, dense_gen) -> np.ndarray:
+        if self.dense is None:
+            return np.zeros((len(dense_gen), 0), dtype=np.float32)
+        queries = np.asarray(dense_gen, dtype=np.float32)
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        if self.dtype == np.float32:
+            # Cosine similarity for the whole batch in one matmul
+            return queries @ self.dense.T
+        # NumPy has no BLAS kernel for float16, so upcast block by block
+        scores = np.empty((len(queries), self.dense.shape[0]), dtype=np.float32)
+        for start in range(0, self.dense.shape[0], self.SCORE_BLOCK_ROWS):
+            block = np.asarray(self.dense[start:start + self.SCORE_BLOCK_ROWS], dtype=np.float32)
+            scores[:, start:start + len(block)] = queries @ block.T
+        return scores
+
+    def _sparse_scores(self, sparse_gen) -> np.ndarray:
+        # Only committed (indexed) rows are searchable
+        num_rows = self._indexed_rows
+        scores = np.zeros((len(sparse_gen), num_rows), dtype=np.float32)
+        for i, sparse in enumerate(sparse_gen):
+            postings_rows, postings_weights = [], []
+            for indptr, rows, values in self.postings:
+                vocab = len(indptr) - 1
+                for term, weight in zip(np.asarray(sparse.indices), np.asarray(sparse.values)):
+                    if term >= vocab:
+                        continue
+                    start, end = indptr[term], indptr[term + 1]
+                    postings_rows.append(rows[start:end])
+                    postings_weights.append(values[start:end] * weight)
+            if postings_rows:
+                scores[i] = np.bincount(
+                    np.concatenate(postings_rows),
+                    weights=np.concatenate(postings_weights),
+                    minlength=num_rows
+                )
+        # Points without any matching term are not sparse hits
+        scores[scores == 0] = -np.inf
+        return scores
+
+    def _dense_search_batch(self, dense_gen, top_k: int, params=None, with_payload: bool = True) -> List[List[models.ScoredPoint]]:
+        return self._top_k(self._dense_scores(dense_gen), top_k)
+
+    def _sparse_search_batch(self, sparse_gen, top_k: int) -> List[List[models.ScoredPoint]]:
+        return self._top_k(self._sparse_scores(sparse_gen), top_k)
+
+    def _fused_search_batch(self, dense_gen, sparse_gen, top_k: int, k: int = 60) -> List[List[models.ScoredPoint]]:
+        # Server-side fusion equivalent: RRF (as in HybridRetriever._rrf_merge), top-k only
+        fused = []
+        for dense_rows, sparse_rows in zip(self._top_k_rows(self._dense_scores(dense_gen), top_k),
+                                           self._top_k_rows(self._sparse_scores(sparse_gen), top_k)):
+            rrf = {}
+            for rows in (dense_rows, sparse_rows):
+                for rank, row in enumerate(rows.tolist()):
+                    rrf[row] = rrf.get(row, 0.0) + 1 / (k + rank + 1)
+            best = sorted(rrf, key=rrf.get, reverse=True)[:top_k]
+            fused.append(self._to_points(np.array(best, dtype=np.int64), np.array([rrf[row] for row in best])))
+        return fused
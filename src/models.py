@@ -0,0 +1,58 @@
+import time
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+
+class ModelRegistry:
+    """Process-wide registry of loaded models.
+
+    ``get(key, loader)`` calls ``loader()`` the first time ``key`` is requested
+    and returns the same instance afterwards, so e.g. the dense encoder is
+    loaded once and shared by chunking, indexing and querying. Load times are
+    kept for ``report()``.
+    """
+
+    def __init__(self):
+        self._models: Dict[Hashable, Any] = {}
+        self._load_times: Dict[Hashable, float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        model = self._models.get(key)
+        if model is not None:
+            return model
+        with self._lock:
+            # Another thread may have finished loading while we waited
+            if key not in self._models:
+                print(f"Loading {key[0]}: {key[1]}")
+                start = time.perf_counter()
+                self._models[key] = loader()
+                self._load_times[key] = time.perf_counter() - start
+                print(f"Loaded {key[1]} in {self._load_times[key]:.1f}s")
+            return self._models[key]
+
+    def loaded(self, key: Hashable) -> bool:
+        return key in self._models
+
+    def report(self) -> Dict[str, float]:
+        """Load time in seconds of every model loaded so far, by ``kind:name``."""
+        return {f"{key[0]}:{key[1]}": seconds for key, seconds in self._load_times.items()}
+
+
+REGISTRY = ModelRegistry()
+
+
+def get_dense_model(model_name: str):
+    """Shared SentenceTransformer (e.g. BGE-M3) for document and query embeddings."""
+    def load():
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name)
+    return REGISTRY.get(("dense model", model_name), load)
+
+
+def get_sparse_model(model_name: str):
+    """Shared fastembed sparse encoder (e.g. SPLADE)."""
+    def load():
+        from fastembed import SparseTextEmbedding
+        return SparseTextEmbedding(model_name=model_name)
+    return REGISTRY.get(("sparse model", model_name), load)
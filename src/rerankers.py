@@ -0,0 +1,221 @@
+import os
+import inspect
+from abc import ABC, abstractmethod
+from typing import List, Optional, Sequence
+import numpy as np
+from omegaconf import DictConfig
+from src.cache import model_slug
+from src.models import REGISTRY
+
+
+class Reranker(ABC):
+    """Cross-encoder scoring of (query, text) pairs.
+
+    Constructing a reranker is cheap: the model is loaded through the shared
+    model registry on first use. ``predict`` sorts pairs by token length before batching so each batch is
+    padded only to the length of its own longest pair, then restores the
+    original order.
+    """
+
+    # Distinguishes score caches of backends that produce slightly different scores
+    backend = "base"
+
+    def __init__(self, model_name: str, max_length: int = 512):
+        self.model_name = model_name
+        self.max_length = max_length
+
+    @property
+    def cache_key(self) -> str:
+        return f"{self.model_name}|{self.backend}|{self.max_length}"
+
+    @property
+    @abstractmethod
+    def tokenizer(self):
+        pass
+
+    @abstractmethod
+    def _predict_sorted(self, pairs: List[List[str]], batch_size: int) -> np.ndarray:
+        pass
+
+    def predict(self, pairs: Sequence[Sequence[str]], batch_size: int = 32) -> np.ndarray:
+        if not pairs:
+            return np.zeros(0, dtype=np.float32)
+        lengths = [
+            len(ids) for ids in self.tokenizer(
+                [p[0] for p in pairs], [p[1] for p in pairs],
+                truncation=True, max_length=self.max_length
+            )["input_ids"]
+        ]
+        order = np.argsort(lengths, kind="stable")
+        sorted_scores = self._predict_sorted([list(pairs[i]) for i in order], batch_size)
+        scores = np.empty(len(pairs), dtype=np.float32)
+        scores[order] = sorted_scores
+        return scores
+
+
+class TorchReranker(Reranker):
+    """sentence-transformers CrossEncoder in full precision (GPU if available)."""
+
+    backend = "torch"
+
+    def __init__(self, model_name: str, max_length: int = 512, threads: Optional[int] = None):
+        super().__init__(model_name, max_length)
+        self.threads = threads
+
+    @property
+    def model(self):
+        return REGISTRY.get(("reranker", self.model_name, self.backend, self.max_length), self._load)
+
+    def _load(self):
+        import torch
+        from sentence_transformers import CrossEncoder
+
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        # NOTE: trust_remote_code=True might be needed for some BGE models,
+        return CrossEncoder(
+            self.model_name,
+            trust_remote_code=True,
+            max_length=self.max_length,
+            device="cuda" if torch.cuda.is_available() else "cpu"
+        )
+
+    @property
+    def tokenizer(self):
+        return self.model.tokenizer
+
+    def _predict_sorted(self, pairs: List[List[str]], batch_size: int) -> np.ndarray:
+        return np.asarray(self.model.predict(pairs, batch_size=batch_size), dtype=np.float32)
+
+
+class OnnxReranker(Reranker):
+    """CPU reranker on ONNX Runtime, optionally with dynamic int8 quantization.
+
+    The Hugging Face model is exported once to ``<export_dir>/<model>/model.v2.onnx``
+    (plus ``model.v2.int8.onnx`` when quantized) and reused afterwards. Logits go
+    through the same activation CrossEncoder applies (see ``_uses_sigmoid``), so
+    scores are comparable with the torch backend.
+    """
+
+    def __init__(self, model_name: str, max_length: int = 512, threads: Optional[int] = None,
+                 quantize: bool = True, export_dir: str = "./models/onnx"):
+        super().__init__(model_name, max_length)
+        self.backend = "onnx-int8" if quantize else "onnx"
+        self.threads = threads
+        self.quantize = quantize
+        self.export_dir = export_dir
+
+    @property
+    def cache_key(self) -> str:
+        # v2: scores use the model's activation (v1 always applied a sigmoid)
+        return f"{super().cache_key}|v2"
+
+    @property
+    def tokenizer(self):
+        return self._loaded()["tokenizer"]
+
+    def _loaded(self) -> dict:
+        return REGISTRY.get(("reranker", self.model_name, self.backend, self.threads), self._load)
+
+    def _load(self) -> dict:
+        import onnxruntime as ort
+        from transformers import AutoConfig, AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        config = AutoConfig.from_pretrained(self.model_name)
+        model_path = self._export(tokenizer, os.path.join(self.export_dir, model_slug(self.model_name)), self.quantize)
+
+        options = ort.SessionOptions()
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        return {
+            "tokenizer": tokenizer,
+            "session": session,
+            "input_names": {i.name for i in session.get_inputs()},
+            "sigmoid": self._uses_sigmoid(config),
+        }
+
+    @staticmethod
+    def _uses_sigmoid(config) -> bool:
+        """CrossEncoder's activation: the one saved with the model (e.g. Identity
+        for cross-encoder/ms-marco-MiniLM-L-6-v2), else sigmoid for single-label models."""
+        saved = (getattr(config, "sentence_transformers", None) or {}).get("activation_fn") \
+            or getattr(config, "sbert_ce_default_activation_function", None)
+        if saved:
+            return saved.rsplit(".", 1)[-1] == "Sigmoid"
+        return config.num_labels == 1
+
+    def _export(self, tokenizer, model_dir: str, quantize: bool) -> str:
+        # v2: inputs bound by name (v1 swapped attention_mask/token_type_ids on BERT models)
+        fp32_path = os.path.join(model_dir, "model.v2.onnx")
+        int8_path = os.path.join(model_dir, "model.v2.int8.onnx")
+        if not os.path.exists(fp32_path):
+            import torch
+            from transformers import AutoModelForSequenceClassification
+
+            print(f"Exporting {self.model_name} to ONNX...")
+            os.makedirs(model_dir, exist_ok=True)
+            model = AutoModelForSequenceClassification.from_pretrained(self.model_name).eval()
+            sample = tokenizer(["query"], ["document"], return_tensors="pt")
+            # Graph inputs follow forward()'s parameter order, not the tokenizer's
+            # (BERT tokenizers return token_type_ids before attention_mask)
+            input_names = [name for name in inspect.signature(model.forward).parameters if name in sample]
+            dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+            dynamic_axes["logits"] = {0: "batch"}
+            with torch.no_grad():
+                torch.onnx.export(
+                    model,
+                    # A trailing dict is passed as keyword arguments
+                    ({name: sample[name] for name in input_names},),
+                    fp32_path,
+                    input_names=input_names,
+                    output_names=["logits"],
+                    dynamic_axes=dynamic_axes,
+                    opset_version=17
+                )
+        if not quantize:
+            return fp32_path
+        if not os.path.exists(int8_path):
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+
+            print(f"Quantizing {self.model_name} to int8...")
+            quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        return int8_path
+
+    def _predict_sorted(self, pairs: List[List[str]], batch_size: int) -> np.ndarray:
+        loaded = self._loaded()
+        scores = []
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            inputs = loaded["tokenizer"](
+                [p[0] for p in batch], [p[1] for p in batch],
+                padding=True, truncation=True, max_length=self.max_length, return_tensors="np"
+            )
+            feed = {name: value.astype(np.int64) for name, value in inputs.items() if name in loaded["input_names"]}
+            logits = loaded["session"].run(["logits"], feed)[0]
+            logits = logits[:, 0]
+            scores.append(1 / (1 + np.exp(-logits)) if loaded["sigmoid"] else logits)
+        return np.concatenate(scores).astype(np.float32)
+
+
+def get_reranker(cfg: DictConfig, model_name: Optional[str] = None) -> Reranker:
+    model_name = model_name or cfg.retrieval.reranker
+    if cfg.retrieval.reranker_backend == "torch":
+        return TorchReranker(
+            model_name,
+            max_length=cfg.retrieval.reranker_max_length,
+            threads=cfg.retrieval.reranker_threads
+        )
+    elif cfg.retrieval.reranker_backend == "onnx":
+        return OnnxReranker(
+            model_name,
+            max_length=cfg.retrieval.reranker_max_length,
+            threads=cfg.retrieval.reranker_threads,
+            quantize=cfg.retrieval.reranker_quantize,
+            export_dir=os.path.join(os.environ.get("HF_HOME", "./models"), "onnx")
+        )
+    else:
+        raise ValueError(f"Unknown reranker backend: {cfg.retrieval.reranker_backend}")
@@ -1,38 +1,79 @@
-import torch
+import os
+import logging
 from typing import List, Dict, Any
-from collections import defaultdict
-from sentence_transformers import CrossEncoder
+from collections import defaultdict, deque
+from src.rerankers import get_reranker
+from src.cache import RerankScoreCache
+from src.tracing import Tracer, NULL_TRACER
+
+log = logging.getLogger(__name__)
 
 class HybridRetriever:
-    def __init__(self, vector_store, cfg):
+    def __init__(self, vector_store, cfg, tracer: Tracer = None):
         self.vector_store = vector_store
         self.cfg = cfg
+        self.tracer = tracer or NULL_TRACER
         self.reranker_model_name = cfg.retrieval.reranker
-        print(f"Loading Reranker: {self.reranker_model_name}")
-        # NOTE: trust_remote_code=True might be needed for some BGE models, 
-        self.reranker = CrossEncoder(
-            self.reranker_model_name, 
-            trust_remote_code=True,
-            device="cuda" if torch.cuda.is_available() else "cpu"
-        )
+        # Rerankers load their model on first use through the shared registry
+        self.reranker = get_reranker(cfg)
         self.top_k_retrieval = cfg.retrieval.top_k_retrieval
         self.top_k_final = cfg.retrieval.top_k_final
+        self.rerank_batch_size = cfg.retrieval.rerank_batch_size
+
+        self.score_cache = self._score_cache(self.reranker)
+
+        # Optional cascade: a cheap first stage prunes candidates before the large reranker
+        self.cascade = cfg.retrieval.cascade if cfg.retrieval.cascade.enabled else None
+        self.first_stage_reranker = None
+        self.first_stage_cache = None
+        if self.cascade is not None and self.cascade.first_stage != "fusion":
+            self.first_stage_reranker = get_reranker(cfg, model_name=self.cascade.first_stage)
+            self.first_stage_cache = self._score_cache(self.first_stage_reranker)
+        # Per-query record of pairs scored by each rerank stage (bounded for long-running use)
+        self.rerank_log = deque(maxlen=100_000)
+
+    def _score_cache(self, reranker):
+        if not self.cfg.cache.rerank_scores:
+            return None
+        return RerankScoreCache(
+            reranker.cache_key,
+            path=os.path.join(self.cfg.cache.dir, "rerank_scores.sqlite"),
+            max_entries=self.cfg.cache.rerank_max_entries
+        )
 
     def retrieve(self, query: str) -> List[Dict[str, Any]]:
-        # 1. First stage retrieval (Dense + Sparse if hybrid)
-        results = self.vector_store.search(query, top_k=self.top_k_retrieval)
-        
+        return self.retrieve_batch([query])[0]
+
+    def retrieve_batch(self, queries: List[str], with_query_vectors: bool = False):
+        """Retrieves and reranks candidates for several queries in one pass.
+
+        With ``with_query_vectors`` it returns ``(candidates_batch, query_vectors)``
+        so callers can reuse the dense query embeddings (e.g. the answer cache).
+        """
+        # 1. First stage retrieval (Dense + Sparse if hybrid), batched per model
+        batch_results = self.vector_store.search_batch(queries, top_k=self.top_k_retrieval)
+
         # 2. Merge (RRF or just dense)
-        if self.cfg.retrieval.strategy == "hybrid":
-            merged_results = self._rrf_merge(results["dense"], results["sparse"])
-        else:
-            # Just dense results, reformatted
-            merged_results = self._normalize_results(results["dense"])
+        merged_batch = []
+        with self.tracer.span("rrf_merge"):
+            for results in batch_results:
+                if "fused" in results:
+                    # Already fused server-side by Qdrant (RRF scores)
+                    merged_batch.append(self._normalize_results(results["fused"]))
+                elif self.cfg.retrieval.strategy == "hybrid":
+                    merged_batch.append(self._rrf_merge(results["dense"], results["sparse"]))
+                else:
+                    # Just dense results, reformatted
+                    merged_batch.append(self._normalize_results(results["dense"]))
 
-        # 3. Rerank
-        reranked_results = self._rerank(query, merged_results)
-        
-        return reranked_results[:self.top_k_final]
+        # 3. Rerank every query's candidates in a single predict call
+        with self.tracer.span("rerank"):
+            reranked_batch = self._rerank_batch(queries, merged_batch)
+
+        final_batch = [reranked[:self.top_k_final] for reranked in reranked_batch]
+        if with_query_vectors:
+            return final_batch, [results["query_vector"] for results in batch_results]
+        return final_batch
 
     def _normalize_results(self, qdrant_points: List[Any]) -> List[Dict[str, Any]]:
         """Converts Qdrant points to a standard dict format."""
@@ -79,15 +120,121 @@ class HybridRetriever:
         return merged
 
     def _rerank(self, query: str, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        if not candidates:
+        return self._rerank_batch([query], [candidates])[0]
+
+    def _rerank_batch(self, queries: List[str], candidates_batch: List[List[Dict[str, Any]]]) -> List[List[Dict[str, Any]]]:
+        if self.cascade is not None:
+            return self._cascade_rerank_batch(queries, candidates_batch)
+
+        # Flatten the (query, chunk) pairs of every query so the cross-encoder
+        # sees them as one stream of fixed-size batches.
+        pairs = [[query, doc["text"]] for query, candidates in zip(queries, candidates_batch) for doc in candidates]
+        if not pairs:
+            return [[] for _ in queries]
+
+        scores = self._score_pairs(pairs)
+
+        offset = 0
+        for query, candidates in zip(queries, candidates_batch):
+            for doc in candidates:
+                doc["rerank_score"] = float(scores[offset])
+                offset += 1
+            # Sort by new rerank score
+            candidates.sort(key=lambda x: x["rerank_score"], reverse=True)
+            self._log_rerank(query, [0, len(candidates)], early_exit=False)
+
+        return candidates_batch
+
+    def _cascade_rerank_batch(self, queries: List[str], candidates_batch: List[List[Dict[str, Any]]]) -> List[List[Dict[str, Any]]]:
+        """Two-stage rerank: a cheap first stage picks an adaptive-depth shortlist for the large model.
+
+        The shortlist always holds the first-stage top ``top_k_final``, plus any
+        further candidates (up to ``max_shortlist``) whose min-max normalized
+        first-stage score is within ``depth_margin`` of the k-th. If the first
+        stage's #1 leads #2 by at least ``early_exit_gap`` (normalized), the
+        large model is skipped for that query altogether.
+        """
+        cascade = self.cascade
+
+        # Stage 1: small cross-encoder over all candidates, or the fusion scores for free
+        if self.first_stage_reranker is None:
+            stage1_batch = [[doc["score"] for doc in candidates] for candidates in candidates_batch]
+            stage1_pairs = [0] * len(queries)
+        else:
+            pairs = [[query, doc["text"]] for query, candidates in zip(queries, candidates_batch) for doc in candidates]
+            scores = self._score_pairs(pairs, self.first_stage_reranker, self.first_stage_cache) if pairs else []
+            stage1_batch, offset = [], 0
+            for candidates in candidates_batch:
+                stage1_batch.append([float(score) for score in scores[offset:offset + len(candidates)]])
+                offset += len(candidates)
+            stage1_pairs = [len(candidates) for candidates in candidates_batch]
+
+        # Shortlist per query
+        shortlists = []
+        for candidates, stage1 in zip(candidates_batch, stage1_batch):
+            for doc, score in zip(candidates, stage1):
+                doc["rerank_score"] = score
+            candidates.sort(key=lambda x: x["rerank_score"], reverse=True)
+            norm = self._minmax([doc["rerank_score"] for doc in candidates])
+
+            k = min(self.top_k_final, len(candidates))
+            if cascade.early_exit_gap is not None and len(norm) > 1 and norm[0] - norm[1] >= cascade.early_exit_gap:
+                shortlists.append(0)
+                continue
+            depth = k
+            while depth < min(cascade.max_shortlist, len(candidates)) and norm[depth] >= norm[k - 1] - cascade.depth_margin:
+                depth += 1
+            shortlists.append(depth)
+
+        # Stage 2: large model on every query's shortlist in one predict call
+        pairs = [[query, doc["text"]] for query, candidates, depth in zip(queries, candidates_batch, shortlists)
+                 for doc in candidates[:depth]]
+        scores = self._score_pairs(pairs) if pairs else []
+        offset = 0
+        for query, candidates, depth, n_stage1 in zip(queries, candidates_batch, shortlists, stage1_pairs):
+            head = candidates[:depth]
+            for doc in head:
+                doc["rerank_score"] = float(scores[offset])
+                offset += 1
+            head.sort(key=lambda x: x["rerank_score"], reverse=True)
+            # Candidates outside the shortlist keep their first-stage order behind it
+            candidates[:depth] = head
+            self._log_rerank(query, [n_stage1, depth], early_exit=depth == 0)
+
+        return candidates_batch
+
+    @staticmethod
+    def _minmax(scores: List[float]) -> List[float]:
+        if not scores:
             return []
-            
-        pairs = [[query, doc["text"]] for doc in candidates]
-        scores = self.reranker.predict(pairs)
-        
-        for i, doc in enumerate(candidates):
-            doc["rerank_score"] = float(scores[i])
-            
-        # Sort by new rerank score
-        candidates.sort(key=lambda x: x["rerank_score"], reverse=True)
-        return candidates
+        low, high = min(scores), max(scores)
+        if high == low:
+            return [1.0] * len(scores)
+        return [(score - low) / (high - low) for score in scores]
+
+    def _log_rerank(self, query: str, stage_pairs: List[int], early_exit: bool):
+        """Records how many (query, chunk) pairs each rerank stage scored for a query."""
+        entry = {"query": query, "stage1_pairs": stage_pairs[0], "stage2_pairs": stage_pairs[1], "early_exit": early_exit}
+        self.rerank_log.append(entry)
+        log.debug(f"Rerank pairs: stage1={entry['stage1_pairs']} stage2={entry['stage2_pairs']} "
+                  f"early_exit={early_exit} query={query[:60]!r}")
+
+    def _score_pairs(self, pairs: List[List[str]], reranker=None, score_cache=None) -> List[float]:
+        """Cross-encoder scores for (query, text) pairs; only cache misses hit the model.
+
+        Defaults to the main reranker and its score cache.
+        """
+        if reranker is None:
+            reranker, score_cache = self.reranker, self.score_cache
+        if score_cache is None:
+            return reranker.predict(pairs, batch_size=self.rerank_batch_size)
+
+        scores = score_cache.get_many(pairs)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            missing_pairs = [pairs[i] for i in missing]
+            fresh = reranker.predict(missing_pairs, batch_size=self.rerank_batch_size)
+            score_cache.put_many(missing_pairs, fresh)
+            for i, score in zip(missing, fresh):
+                scores[i] = float(score)
+        return scores
@@ -0,0 +1,130 @@
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List
+import numpy as np
+
+
+class QueueFull(Exception):
+    """Raised when the service is at capacity; callers should retry later."""
+
+
+class MicroBatcher:
+    """Groups concurrent single-item requests into batches for one worker.
+
+    ``submit(item)`` enqueues an item and returns a Future. A worker thread
+    takes the first waiting item, keeps collecting for up to ``max_wait_ms``
+    (or until ``max_batch_size`` items), then calls ``fn(items)`` once and
+    resolves every Future with its result. ``fn`` must return one result per
+    item, in order. At most ``max_queue`` items may wait; beyond that
+    ``submit`` raises ``QueueFull`` instead of letting latency grow unbounded.
+    """
+
+    def __init__(self, fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 16,
+                 max_wait_ms: float = 5.0, max_queue: int = 256):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.batch_sizes = deque(maxlen=10_000)
+        self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, item: Any) -> Future:
+        future = Future()
+        try:
+            self._queue.put_nowait((item, future))
+        except queue.Full:
+            raise QueueFull(f"{self._queue.maxsize} requests already waiting")
+        return future
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def _collect(self) -> List[Any]:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Skip requests whose caller already gave up
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self.fn([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            with self._lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.batch_sizes.append(len(batch))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sizes = np.array(self.batch_sizes)
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "mean_batch_size": float(sizes.mean()) if len(sizes) else 0.0,
+                "max_batch_size": int(sizes.max()) if len(sizes) else 0,
+                "queue_depth": self.qsize(),
+            }
+
+
+class ServiceMetrics:
+    """Request counters and recent per-stage latencies for ``/metrics``.
+
+    Only the last ``window`` samples per stage are kept, so memory stays
+    bounded in a long-running process.
+    """
+
+    def __init__(self, window: int = 10_000):
+        self.window = window
+        self.counters = {"requests": 0, "ok": 0, "rejected": 0, "errors": 0, "answer_cache_hits": 0}
+        self._latencies: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            self._latencies.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = {stage: np.array(values) * 1000 for stage, values in self._latencies.items()}
+            counters = dict(self.counters)
+        return {
+            "uptime_s": time.time() - self.started,
+            **counters,
+            "latency_ms": {
+                stage: {
+                    "count": len(values),
+                    "p50": float(np.percentile(values, 50)),
+                    "p95": float(np.percentile(values, 95)),
+                    "p99": float(np.percentile(values, 99)),
+                }
+                for stage, values in latencies.items() if len(values)
+            },
+        }
@@ -0,0 +1,97 @@
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager, nullcontext
+from collections import defaultdict
+from typing import List, Dict, Any, Optional
+import numpy as np
+
+# Query IDs the current code path is working on (propagates into asyncio tasks
+# and asyncio.to_thread workers).
+_current_query_ids = contextvars.ContextVar("current_query_ids", default=None)
+
+# Shared no-op span returned when tracing is disabled
+_NULL_SPAN = nullcontext()
+
+
+class Tracer:
+    """Lightweight per-stage timing.
+
+    ``span(stage)`` times a block and attributes it to the query IDs set by
+    the enclosing ``trace(query_ids)``. Batched stages produce one span
+    covering every query in the batch. Each span is appended as a JSON line
+    to ``path`` (if given), and ``summary()`` reports p50/p95/p99 per stage.
+    When disabled, ``span`` and ``trace`` return a shared no-op context.
+    """
+
+    def __init__(self, enabled: bool = False, path: Optional[str] = None):
+        self.enabled = enabled
+        self._durations = defaultdict(list)
+        self._lock = threading.Lock()
+        self._file = open(path, "w") if enabled and path else None
+
+    def trace(self, query_ids: List[str]):
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._trace(query_ids)
+
+    def span(self, stage: str):
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._span(stage)
+
+    @contextmanager
+    def _trace(self, query_ids: List[str]):
+        token = _current_query_ids.set(list(query_ids))
+        try:
+            yield
+        finally:
+            _current_query_ids.reset(token)
+
+    @contextmanager
+    def _span(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage: str, seconds: float):
+        """Records an externally measured duration (e.g. time to first token)."""
+        if not self.enabled:
+            return
+        query_ids = _current_query_ids.get()
+        with self._lock:
+            self._durations[stage].append(seconds)
+            if self._file is not None:
+                self._file.write(json.dumps({
+                    "stage": stage,
+                    "query_ids": query_ids,
+                    "ms": seconds * 1000,
+                    "ts": time.time(),
+                }) + "\n")
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Per-stage span count, total and p50/p95/p99 latency in milliseconds."""
+        with self._lock:
+            durations = {stage: np.array(values) * 1000 for stage, values in self._durations.items()}
+        return {
+            stage: {
+                "count": len(values),
+                "total_ms": float(values.sum()),
+                "p50_ms": float(np.percentile(values, 50)),
+                "p95_ms": float(np.percentile(values, 95)),
+                "p99_ms": float(np.percentile(values, 99)),
+            }
+            for stage, values in durations.items()
+        }
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# Default for components constructed without a tracer
+NULL_TRACER = Tracer(enabled=False)
@@ -1,116 +1,464 @@
 import os
-from typing import List, Dict, Any, Optional
+import time
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Iterable, Iterator, TYPE_CHECKING
 from uuid import uuid4
 from qdrant_client import QdrantClient, models
 from qdrant_client.http.models import Distance, VectorParams, SparseVectorParams
-from llama_index.core.schema import TextNode
-from fastembed import SparseTextEmbedding
-from sentence_transformers import SentenceTransformer
 from omegaconf import DictConfig
+import numpy as np
+from src.cache import EmbeddingCache
+from src.models import get_dense_model, get_sparse_model
+from src.tracing import Tracer, NULL_TRACER
+
+if TYPE_CHECKING:
+    # Only for type hints: importing llama_index loads its whole node_parser package
+    from llama_index.core.schema import TextNode
+
+def _batched(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
 
 class HybridQdrantClient:
-    def __init__(self, cfg: DictConfig):
-        if cfg.qdrant.host == ":memory:":
-             self.client = QdrantClient(location=":memory:")
-        else:
-             self.client = QdrantClient(host=cfg.qdrant.host, port=cfg.qdrant.port)
+    def __init__(self, cfg: DictConfig, tracer: Optional[Tracer] = None):
+        self.tracer = tracer or NULL_TRACER
+        self.client = self._connect(cfg)
 
         self.collection_name = cfg.qdrant.collection_name
         self.dense_model_name = cfg.retrieval.dense_model
-        # Initialize embedding models
+        self.encode_batch_size = cfg.retrieval.query_batch_size
+        self.ingest_batch_size = cfg.ingestion.batch_size
+        # Embedding models are loaded on first use (see dense_model/sparse_model)
         # NOTE: BGE-M3 is supported by SentenceTransformer
-        print(f"Loading Dense Model: {self.dense_model_name}")
-        self.dense_model = SentenceTransformer(self.dense_model_name)
-        
-        # init sparse model if hybrid
         self.use_sparse = cfg.retrieval.strategy == "hybrid"
         if self.use_sparse:
              self.sparse_model_name = "prithivida/Splade_PP_En_v1" # Standard good sparse
-             print(f"Loading Sparse Model: {self.sparse_model_name}")
-             self.sparse_model = SparseTextEmbedding(model_name=self.sparse_model_name)
+        # "client" fuses in HybridRetriever._rrf_merge, "server" uses Qdrant's prefetch + RRF query
+        self.fusion = cfg.retrieval.fusion
+        self.index_cfg = cfg.qdrant
+        self.search_params = self._search_params()
+
+        # Query embedding caches (in-memory LRU + memory-mapped store on disk)
+        self.dense_cache = None
+        self.sparse_cache = None
+        if cfg.cache.query_embeddings:
+            self.dense_cache = EmbeddingCache(
+                self.dense_model_name, kind="dense",
+                cache_dir=cfg.cache.dir, max_memory_items=cfg.cache.memory_items
+            )
+            if self.use_sparse:
+                self.sparse_cache = EmbeddingCache(
+                    self.sparse_model_name, kind="sparse",
+                    cache_dir=cfg.cache.dir, max_memory_items=cfg.cache.memory_items
+                )
 
         self._ensure_collection()
 
+    @property
+    def dense_model(self):
+        return get_dense_model(self.dense_model_name)
+
+    @property
+    def sparse_model(self):
+        return get_sparse_model(self.sparse_model_name)
+
+    def _connect(self, cfg: DictConfig) -> Optional[QdrantClient]:
+        if cfg.qdrant.host == ":memory:":
+             return QdrantClient(location=":memory:")
+        return QdrantClient(host=cfg.qdrant.host, port=cfg.qdrant.port)
+
     def _ensure_collection(self):
         if not self.client.collection_exists(self.collection_name):
             print(f"Creating collection {self.collection_name}")
             dim = self.dense_model.get_sentence_embedding_dimension()
             vectors_config = {
-                "dense": VectorParams(size=dim, distance=Distance.COSINE)
+                "dense": VectorParams(
+                    size=dim,
+                    distance=Distance.COSINE,
+                    on_disk=self.index_cfg.on_disk,
+                    hnsw_config=models.HnswConfigDiff(
+                        m=self.index_cfg.hnsw.m,
+                        ef_construct=self.index_cfg.hnsw.ef_construct
+                    ),
+                    quantization_config=self._quantization_config()
+                )
             }
             sparse_vectors_config = {}
             if self.use_sparse:
-                sparse_vectors_config["sparse"] = SparseVectorParams()
+                sparse_vectors_config["sparse"] = SparseVectorParams(
+                    index=models.SparseIndexParams(on_disk=self.index_cfg.sparse_on_disk)
+                )
 
             self.client.create_collection(
                 collection_name=self.collection_name,
                 vectors_config=vectors_config,
                 sparse_vectors_config=sparse_vectors_config,
             )
+            # Lets incremental ingestion delete a document's chunks by filter
+            self.client.create_payload_index(
+                collection_name=self.collection_name,
+                field_name="doc_hash",
+                field_schema=models.PayloadSchemaType.KEYWORD
+            )
+        else:
+            self._apply_index_layout()
+
+    def _configured_layout(self) -> Dict[str, Any]:
+        return {
+            "quantization": self.index_cfg.quantization,
+            "quantization_always_ram": self.index_cfg.quantization_always_ram if self.index_cfg.quantization != "none" else None,
+            "on_disk": self.index_cfg.on_disk,
+            "hnsw_m": self.index_cfg.hnsw.m,
+            "hnsw_ef_construct": self.index_cfg.hnsw.ef_construct,
+            "sparse_on_disk": self.index_cfg.sparse_on_disk if self.use_sparse else None,
+        }
+
+    def index_layout(self) -> Dict[str, Any]:
+        """Dense/sparse index layout the collection actually has (same keys as the config)."""
+        config = self.client.get_collection(self.collection_name).config
+        dense = config.params.vectors["dense"]
+        # Per-vector settings override the collection-wide ones
+        hnsw = dense.hnsw_config or config.hnsw_config
+        quantization = dense.quantization_config or config.quantization_config
+        kind, always_ram = "none", None
+        if isinstance(quantization, models.ScalarQuantization):
+            kind, always_ram = "scalar", quantization.scalar.always_ram
+        elif isinstance(quantization, models.BinaryQuantization):
+            kind, always_ram = "binary", quantization.binary.always_ram
+        sparse = (config.params.sparse_vectors or {}).get("sparse")
+        return {
+            "quantization": kind,
+            "quantization_always_ram": bool(always_ram) if kind != "none" else None,
+            "on_disk": bool(dense.on_disk),
+            "hnsw_m": hnsw.m if hnsw.m is not None else config.hnsw_config.m,
+            "hnsw_ef_construct": hnsw.ef_construct if hnsw.ef_construct is not None else config.hnsw_config.ef_construct,
+            "sparse_on_disk": bool(sparse.index and sparse.index.on_disk) if self.use_sparse and sparse else None,
+        }
+
+    def _apply_index_layout(self):
+        """Brings an existing collection's layout in line with the config.
+
+        HNSW, on-disk and quantization settings are otherwise only applied at
+        creation, so a sweep over them would keep measuring the first layout.
+        Qdrant rebuilds the affected segments; we wait until it is done.
+        """
+        current, configured = self.index_layout(), self._configured_layout()
+        if current == configured:
+            return
+        changed = {key: (current[key], value) for key, value in configured.items() if current[key] != value}
+        print(f"Updating index layout of {self.collection_name}: {changed}")
+        sparse_vectors_config = None
+        if self.use_sparse:
+            sparse_vectors_config = {
+                "sparse": SparseVectorParams(index=models.SparseIndexParams(on_disk=self.index_cfg.sparse_on_disk))
+            }
+        self.client.update_collection(
+            collection_name=self.collection_name,
+            vectors_config={
+                "dense": models.VectorParamsDiff(
+                    on_disk=self.index_cfg.on_disk,
+                    hnsw_config=models.HnswConfigDiff(
+                        m=self.index_cfg.hnsw.m,
+                        ef_construct=self.index_cfg.hnsw.ef_construct
+                    ),
+                    quantization_config=self._quantization_config() or models.Disabled.DISABLED
+                )
+            },
+            sparse_vectors_config=sparse_vectors_config,
+        )
+        while self.client.get_collection(self.collection_name).status == models.CollectionStatus.YELLOW:
+            time.sleep(1)
+        if self.index_layout() != configured:
+            # e.g. the in-process ":memory:" client ignores layout updates
+            print(f"Collection {self.collection_name} kept layout {self.index_layout()}")
+
+    def _quantization_config(self):
+        quantization = self.index_cfg.quantization
+        if quantization == "none":
+            return None
+        if quantization == "scalar":
+            return models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8,
+                quantile=0.99,
+                always_ram=self.index_cfg.quantization_always_ram
+            ))
+        if quantization == "binary":
+            return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(
+                always_ram=self.index_cfg.quantization_always_ram
+            ))
+        raise ValueError(f"Unknown quantization: {quantization}")
+
+    def _search_params(self, exact: bool = False) -> models.SearchParams:
+        quantization = None
+        if self.index_cfg.quantization != "none":
+            # Search the quantized vectors with oversampling, then rescore with the originals
+            quantization = models.QuantizationSearchParams(
+                rescore=self.index_cfg.rescore,
+                oversampling=self.index_cfg.oversampling
+            )
+        return models.SearchParams(hnsw_ef=self.index_cfg.hnsw.ef, exact=exact, quantization=quantization)
+
+    def count(self) -> int:
+        return self.client.count(collection_name=self.collection_name, exact=True).count
 
-    def index(self, nodes: List[TextNode]):
+    def delete_documents(self, doc_hashes: List[str]):
+        """Deletes every chunk whose ``doc_hash`` payload is in ``doc_hashes``."""
+        if not doc_hashes:
+            return
+        self.client.delete(
+            collection_name=self.collection_name,
+            points_selector=models.FilterSelector(
+                filter=models.Filter(must=[
+                    models.FieldCondition(key="doc_hash", match=models.MatchAny(any=list(doc_hashes)))
+                ])
+            ),
+            wait=True
+        )
+
+    def index(self, nodes: Iterable["TextNode"], batch_size: Optional[int] = None) -> int:
+        """Embeds and upserts nodes as a stream of fixed-size batches.
+
+        ``nodes`` can be any iterable (typically a generator), so peak memory
+        is bounded by the batch size rather than the corpus size. The upsert of
+        one batch runs in a background thread while the next batch is embedded.
+        """
+        batch_size = batch_size or self.ingest_batch_size
+        total = 0
+        with ThreadPoolExecutor(max_workers=1) as uploader:
+            pending = None
+            for batch in _batched(nodes, batch_size):
+                points = self._build_points(batch)
+                # Keep at most one upload in flight
+                if pending is not None:
+                    pending.result()
+                pending = uploader.submit(self._upsert, points)
+                total += len(points)
+                print(f"Indexed {total} points into {self.collection_name}...")
+            if pending is not None:
+                pending.result()
+        return total
+
+    def _build_points(self, nodes: List["TextNode"]) -> List[models.PointStruct]:
         documents = [node.get_content() for node in nodes]
         metadatas = [node.metadata for node in nodes]
         ids = [node.node_id for node in nodes]
 
         # Generate Dense Embeddings
-        print("Generating Dense Embeddings...")
         dense_embeddings = self.dense_model.encode(documents, convert_to_numpy=True)
-        
-        points = []
-        
+
         sparse_embeddings = None
         if self.use_sparse:
-            print("Generating Sparse Embeddings...")
             sparse_embeddings = list(self.sparse_model.embed(documents))
 
+        points = []
         for i in range(len(nodes)):
             vector = {"dense": dense_embeddings[i].tolist()}
             if self.use_sparse:
                 # NOTE: check the slicing of sparse_embeddings[i] 
-                vector["sparse"] = models.SparseVector(
-                    indices=sparse_embeddings[i].indices.tolist(), 
-                    values=sparse_embeddings[i].values.tolist()
-                )
+                vector["sparse"] = self._to_sparse_vector(sparse_embeddings[i])
             
             points.append(models.PointStruct(
                 id=ids[i], # Qdrant prefers UUID or int
                 vector=vector,
                 payload={ "text": documents[i], **metadatas[i] }
             ))
-            
-        print(f"Upserting {len(points)} points to Qdrant...")
+        return points
+
+    def _upsert(self, points: List[models.PointStruct]):
         self.client.upsert(
             collection_name=self.collection_name,
-            points=points
+            points=points,
+            wait=True
         )
 
-    def search(self, query: str, top_k: int = 20) -> List[Dict[str, Any]]:
+    def search(self, query: str, top_k: int = 20) -> Dict[str, Any]:
         # NOTE FOR ABDELLAH: This will be used by retrieval.py
-        # Dense Search
-        dense_gen = self.dense_model.encode([query], convert_to_numpy=True)[0]
-        dense_results = self.client.query_points(
-            collection_name=self.collection_name,
-            query=dense_gen.tolist(),
-            using="dense",
-            limit=top_k,
-            with_payload=True
-        ).points
-        
-        results = {"dense": dense_results, "sparse": []}
+        return self.search_batch([query], top_k=top_k)[0]
+
+    def search_batch(self, queries: List[str], top_k: int = 20) -> List[Dict[str, Any]]:
+        """Runs dense (and sparse) search for many queries at once.
 
+        Each encoder does a single batched forward pass over all queries and the
+        searches go to Qdrant through its batch query endpoint. With
+        ``fusion: server`` the dense and sparse sub-queries of a query are sent
+        together as prefetches and Qdrant returns only the RRF-fused top-k.
+        Each result also carries the dense ``query_vector`` it was searched with.
+        """
+        if not queries:
+            return []
+
+        with self.tracer.span("dense_encode"):
+            dense_gen = self.encode_dense(queries)
+        sparse_gen = []
         if self.use_sparse:
-            sparse_gen = list(self.sparse_model.embed([query]))[0]
-            sparse_results = self.client.query_points(
-                collection_name=self.collection_name,
-                query=models.SparseVector(
-                    indices=sparse_gen.indices.tolist(),
-                    values=sparse_gen.values.tolist()
-                ),
+            with self.tracer.span("sparse_encode"):
+                sparse_gen = self.encode_sparse(queries)
+
+        if self.use_sparse and self.fusion == "server":
+            with self.tracer.span("fused_search"):
+                fused = self._fused_search_batch(dense_gen, sparse_gen, top_k)
+            return [{"dense": [], "sparse": [], "fused": points, "query_vector": vector}
+                    for points, vector in zip(fused, dense_gen)]
+
+        with self.tracer.span("dense_search"):
+            dense_points = self._dense_search_batch(dense_gen, top_k)
+        results = [{"dense": points, "sparse": [], "query_vector": vector}
+                   for points, vector in zip(dense_points, dense_gen)]
+
+        if self.use_sparse:
+            with self.tracer.span("sparse_search"):
+                sparse_points = self._sparse_search_batch(sparse_gen, top_k)
+            for result, points in zip(results, sparse_points):
+                result["sparse"] = points
+
+        return results
+
+    def _dense_search_batch(self, dense_gen, top_k: int, params: Optional[models.SearchParams] = None,
+                            with_payload: bool = True) -> List[List[models.ScoredPoint]]:
+        requests = [
+            models.QueryRequest(
+                query=vector.tolist(),
+                using="dense",
+                limit=top_k,
+                params=params or self.search_params,
+                with_payload=with_payload
+            )
+            for vector in dense_gen
+        ]
+        responses = self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=requests
+        )
+        return [response.points for response in responses]
+
+    def _sparse_search_batch(self, sparse_gen, top_k: int) -> List[List[models.ScoredPoint]]:
+        requests = [
+            models.QueryRequest(
+                query=self._to_sparse_vector(sparse),
                 using="sparse",
                 limit=top_k,
                 with_payload=True
-            ).points
-            results["sparse"] = sparse_results
-            
-        return results
+            )
+            for sparse in sparse_gen
+        ]
+        responses = self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=requests
+        )
+        return [response.points for response in responses]
+
+    def index_report(self, queries: List[str], top_k: int = 20) -> Dict[str, Any]:
+        """Recall, latency and memory of the collection's dense index.
+
+        Recall@k is measured against exact (brute-force) search over the same
+        collection; memory is estimated from the point count and vector layout.
+        """
+        dense_gen = self.encode_dense(queries)
+
+        start = time.perf_counter()
+        approx = self._dense_search_batch(dense_gen, top_k, with_payload=False)
+        approx_s = time.perf_counter() - start
+        start = time.perf_counter()
+        exact = self._dense_search_batch(dense_gen, top_k, params=self._search_params(exact=True), with_payload=False)
+        exact_s = time.perf_counter() - start
+
+        overlaps = [
+            len({p.id for p in a} & {p.id for p in e}) / len(e)
+            for a, e in zip(approx, exact) if e
+        ]
+
+        # The layout the collection was actually built with, not the configured one
+        layout = self.index_layout()
+        points = self.count()
+        dim = dense_gen.shape[1]
+        original_bytes = points * dim * 4
+        quantized_bytes = {"none": 0, "scalar": points * dim, "binary": points * dim // 8}[layout["quantization"]]
+        ram_bytes = quantized_bytes if layout["quantization_always_ram"] else 0
+        if not layout["on_disk"]:
+            ram_bytes += original_bytes
+        return {
+            **layout,
+            "hnsw_ef": self.index_cfg.hnsw.ef,
+            "points": points,
+            f"recall@{top_k}_vs_exact": float(np.mean(overlaps)) if overlaps else None,
+            "dense_search_ms_per_query": approx_s * 1000 / len(queries),
+            "exact_search_ms_per_query": exact_s * 1000 / len(queries),
+            "est_vector_ram_mb": ram_bytes / 2**20,
+            "est_vector_disk_mb": (original_bytes + quantized_bytes) / 2**20,
+        }
+
+    def encode_dense(self, queries: List[str]) -> np.ndarray:
+        """Dense query embeddings, served from the cache where possible."""
+        def encode(texts):
+            return self.dense_model.encode(texts, batch_size=self.encode_batch_size, convert_to_numpy=True)
+        return np.stack(self._cached_encode(self.dense_cache, queries, encode))
+
+    def encode_sparse(self, queries: List[str]) -> List[Any]:
+        """Sparse query embeddings (anything exposing ``indices``/``values``)."""
+        def encode(texts):
+            return list(self.sparse_model.embed(texts, batch_size=self.encode_batch_size))
+        return self._cached_encode(self.sparse_cache, queries, encode)
+
+    @staticmethod
+    def _cached_encode(cache: Optional[EmbeddingCache], queries: List[str], encode) -> List[Any]:
+        if cache is None:
+            return list(encode(queries))
+
+        embeddings = cache.get_many(queries)
+        # Encode each distinct missing query once, in a single batch
+        missing = list(dict.fromkeys(q for q, e in zip(queries, embeddings) if e is None))
+        if missing:
+            fresh = dict(zip(missing, cache.put_many(missing, list(encode(missing)))))
+            embeddings = [e if e is not None else fresh[q] for q, e in zip(queries, embeddings)]
+        return embeddings
+
+    def cache_stats(self) -> List[Dict[str, Any]]:
+        return [cache.stats() for cache in (self.dense_cache, self.sparse_cache) if cache is not None]
+
+    def _fused_search_batch(self, dense_gen, sparse_gen, top_k: int) -> List[List[models.ScoredPoint]]:
+        # Prefetch candidates are only used for ranking inside Qdrant, so
+        # payloads are fetched for the fused survivors alone.
+        requests = [
+            models.QueryRequest(
+                prefetch=[
+                    models.Prefetch(query=dense.tolist(), using="dense", limit=top_k, params=self.search_params),
+                    models.Prefetch(query=self._to_sparse_vector(sparse), using="sparse", limit=top_k),
+                ],
+                query=models.FusionQuery(fusion=models.Fusion.RRF),
+                limit=top_k,
+                with_payload=True
+            )
+            for dense, sparse in zip(dense_gen, sparse_gen)
+        ]
+        responses = self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=requests
+        )
+        return [response.points for response in responses]
+
+    @staticmethod
+    def _to_sparse_vector(sparse_embedding) -> models.SparseVector:
+        return models.SparseVector(
+            indices=sparse_embedding.indices.tolist(),
+            values=sparse_embedding.values.tolist()
+        )
+
+def get_collection_name(cfg):
+    # Dynamic collection name based on chunking strategy
+    if cfg.chunking.strategy == "fixed":
+        name = f"finance_fixed_{cfg.chunking.chunk_size}_{cfg.chunking.chunk_overlap}"
+    else:
+        name = f"finance_semantic_{cfg.chunking.breakpoint_percentile_threshold}"
+    # Quantized layouts get their own collection so they can be compared side by side
+    if cfg.qdrant.quantization != "none":
+        name += f"_{cfg.qdrant.quantization}"
+    return name
+
+def get_vector_store(cfg: DictConfig, tracer: Optional[Tracer] = None) -> HybridQdrantClient:
+    """Qdrant (server or ``:memory:``) by default; ``qdrant.host: local`` selects the in-process store."""
+    if cfg.qdrant.host == "local":
+        from src.local_store import LocalVectorStore
+        return LocalVectorStore(cfg, tracer=tracer)
+    return HybridQdrantClient(cfg, tracer=tracer)